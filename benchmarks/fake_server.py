@@ -0,0 +1,55 @@
+"""
+Local stand-in HTTP server for the Prefect and Vault APIs used by datario_cli.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+import time
+
+# Secrets served under /v1/<path>, like a Vault KV v2 engine does
+SECRETS = {}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the Prefect GraphQL API does to an empty GET request, and serves `SECRETS` like
+    a Vault KV v2 engine.
+    """
+    latency = 0.0
+
+    def do_GET(self):  # noqa: N802
+        time.sleep(self.latency)
+        if self.path.rstrip("/") == "/api":
+            self.respond(400, b"GET query missing.")
+        elif self.path.startswith("/v1/") and self.path[len("/v1/"):] in SECRETS:
+            if not self.headers.get("X-Vault-Token"):
+                self.respond(403, b'{"errors": ["permission denied"]}', "application/json")
+                return
+            body = {
+                "lease_duration": 0,
+                "data": {"data": SECRETS[self.path[len("/v1/"):]], "metadata": {"version": 1}},
+            }
+            self.respond(200, json.dumps(body).encode("utf-8"), "application/json")
+        else:
+            self.respond(404, b"Not found")
+
+    def respond(self, status: int, body: bytes, content_type: str = "text/plain") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Starts the server on a random local port, on a background thread.
+    """
+    handler = type("Handler", (FakeHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,251 @@
+"""
+End-to-end benchmarks for datario_cli commands.
+
+Every command runs on a fresh home directory, with fake terraform/helm/kubectl/git binaries on
+PATH (see `shims.py`) and stand-in Prefect and Vault APIs (see `fake_server.py`). For each command this
+measures the wall-clock latency, the number of subprocesses started by `echo_and_run`, the number
+of calls to the fake binaries and the peak memory of the CLI process.
+
+Usage:
+
+    python benchmarks/run.py                    # prints results
+    python benchmarks/run.py --save default     # saves them to benchmarks/baselines/default.json
+    python benchmarks/run.py --save default "gke plan"  # only updates that scenario's entry
+    python benchmarks/run.py --compare default  # fails on regressions against that baseline
+"""
+
+import argparse
+import base64
+import json
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_server import SECRETS, start_server
+from shims import install_shims
+
+BASELINES_DIRECTORY = Path(__file__).parent / "baselines"
+REPOSITORY_DIRECTORY = Path(__file__).parent.parent
+
+# Configurations of the benchmark homes, in the order `config init` prompts for them. Paths are
+# relative to the home directory.
+ENVS = {
+    "BASEDOSDADOS_CREDENTIALS_PROD_PATH": "~/credentials.json",
+    "BASEDOSDADOS_CREDENTIALS_STAGING_PATH": "~/credentials.json",
+    "GOOGLE_APPLICATION_CREDENTIALS": "~/credentials.json",
+    "TF_VAR_bucket_name": "datario-bench-tfstate",
+    "TF_VAR_project_id": "datario-bench",
+    "VAULT_TOKEN": "hvs." + "a" * 24,
+    "PREFECT_TOKEN": "b" * 24,
+    "PREFECT_TENANT_ID": "00000000-0000-0000-0000-000000000000",
+}
+
+SCENARIOS = {
+    "version": (["version"], ""),
+    "config init": (["config", "init"], "y\n" + "".join(f"{value}\n" for value in ENVS.values())),
+    "config show": (["config", "show"], ""),
+    "config update": (["config", "update"], "\n" * 20),
+    "config reset": (["config", "reset"], "n\n"),
+    "config doctor": (["config", "doctor"], ""),
+    "gke plan": (["gke", "plan"], ""),
+    "gke apply": (["gke", "apply"], ""),
+    "gke status": (["gke", "status"], ""),
+    "gke destroy": (["gke", "destroy"], "y\n"),
+    "prefect build": (["prefect", "build"], ""),
+    "prefect build (vault)": (["prefect", "build"], ""),
+    "prefect apply": (["prefect", "apply"], ""),
+    "prefect status": (["prefect", "status"], ""),
+    "prefect destroy": (["prefect", "destroy"], "y\n"),
+}
+
+# Scenarios whose credentials are read from the stand-in Vault
+VAULT_SCENARIOS = {"prefect build (vault)"}
+
+CREDENTIALS = {
+    "type": "service_account",
+    "project_id": "datario-bench",
+    "private_key_id": "0" * 40,
+    "client_email": "bench@datario-bench.iam.gserviceaccount.com",
+}
+
+
+def build_home(directory: Path, vault: bool = False) -> None:
+    """
+    Creates a home directory with a complete datario configuration, optionally pointing to Vault
+    for the credentials.
+    """
+    (directory / "credentials.json").write_text(json.dumps(CREDENTIALS))
+    envs = {
+        key: str(directory / value[2:]) if value.startswith("~/") else value
+        for key, value in ENVS.items()
+    }
+    if vault:
+        envs.update({
+            "BASEDOSDADOS_CREDENTIALS_PROD_PATH": "vault:secret/data/basedosdados#prod",
+            "BASEDOSDADOS_CREDENTIALS_STAGING_PATH": "vault:secret/data/basedosdados#staging",
+            "PREFECT_TOKEN": "vault:secret/data/prefect#token",
+            "PREFECT_TENANT_ID": "vault:secret/data/prefect#tenant_id",
+        })
+    (directory / ".datario").mkdir(parents=True, exist_ok=True)
+    (directory / ".datario" / "envs.json").write_text(json.dumps({
+        key: base64.b64encode(value.encode("utf-8")).decode("utf-8")
+        for key, value in envs.items()
+    }))
+
+
+def run_scenario(args: list, stdin: str, env: dict, vault: bool = False) -> dict:
+    """
+    Runs the CLI once on a fresh home directory and returns its measurements.
+    """
+    with tempfile.TemporaryDirectory() as home:
+        home = Path(home)
+        build_home(home, vault)
+        calls = home / "calls.jsonl"
+        trace = home / "trace.json"
+        env = dict(env, HOME=str(home), DATARIO_BENCH_CALLS=str(calls),
+                   DATARIO_PROFILE="1", DATARIO_PROFILE_OUTPUT=str(trace))
+        start = time.perf_counter()
+        popen = subprocess.Popen(
+            [sys.executable, "-c", "from datario_cli.cli import app; app()", *args],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            env=env, cwd=REPOSITORY_DIRECTORY,
+        )
+        popen.stdin.write(stdin.encode("utf-8"))
+        popen.stdin.close()
+        stderr = popen.stderr.read()
+        _, status, rusage = os.wait4(popen.pid, 0)
+        latency = time.perf_counter() - start
+        popen.returncode = os.waitstatus_to_exitcode(status)
+        if popen.returncode:
+            raise RuntimeError(
+                f"`{' '.join(args)}` failed with exit code {popen.returncode}:\n"
+                f"{stderr.decode('utf-8', 'replace')}")
+        events = json.loads(trace.read_text())["traceEvents"] if trace.exists() else []
+        return {
+            "latency_s": latency,
+            "subprocesses": sum(1 for event in events if event["cat"] == "subprocess"),
+            "tool_calls": len(calls.read_text().splitlines()) if calls.exists() else 0,
+            "peak_rss_kb": rusage.ru_maxrss,
+        }
+
+
+def run_benchmarks(scenarios: list, repeat: int, latency: float, lines: int) -> dict:
+    """
+    Runs the given scenarios, returning the median latency and the maximum of the other metrics.
+    """
+    with tempfile.TemporaryDirectory() as shims_directory:
+        install_shims(Path(shims_directory))
+        SECRETS.update({
+            "secret/data/basedosdados": {"prod": CREDENTIALS, "staging": CREDENTIALS},
+            "secret/data/prefect": {
+                "token": "b" * 24,
+                "tenant_id": "00000000-0000-0000-0000-000000000000",
+            },
+        })
+        server = start_server()
+        env = dict(
+            os.environ,
+            PATH=f"{shims_directory}{os.pathsep}{os.environ.get('PATH', '')}",
+            DATARIO_PREFECT_API_ADDRESS=f"http://127.0.0.1:{server.server_port}/api",
+            DATARIO_VAULT_ADDRESS=f"http://127.0.0.1:{server.server_port}",
+            DATARIO_BENCH_LATENCY=str(latency),
+            DATARIO_BENCH_LINES=str(lines),
+        )
+        results = {}
+        try:
+            for name in scenarios:
+                args, stdin = SCENARIOS[name]
+                runs = [run_scenario(args, stdin, env, name in VAULT_SCENARIOS)
+                        for _ in range(repeat)]
+                results[name] = {
+                    "latency_s": round(statistics.median(run["latency_s"] for run in runs), 4),
+                    "subprocesses": max(run["subprocesses"] for run in runs),
+                    "tool_calls": max(run["tool_calls"] for run in runs),
+                    "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+                }
+                print(f"{name:<22} {results[name]['latency_s']:>8.3f}s"
+                      f" {results[name]['subprocesses']:>4} subprocesses"
+                      f" {results[name]['tool_calls']:>4} tool calls"
+                      f" {results[name]['peak_rss_kb'] / 1024:>7.1f} MiB")
+        finally:
+            server.shutdown()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compares results against a baseline, returning the list of regressions found.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        if result["latency_s"] > expected["latency_s"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: latency {result['latency_s']:.3f}s > {expected['latency_s']:.3f}s")
+        for metric in ["subprocesses", "tool_calls"]:
+            if result[metric] > expected[metric]:
+                regressions.append(f"{name}: {metric} {result[metric]} > {expected[metric]}")
+        if result["peak_rss_kb"] > expected["peak_rss_kb"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: peak memory {result['peak_rss_kb']} KiB > {expected['peak_rss_kb']} KiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS),
+                        help=f"Scenarios to run (default: all). Choices: {list(SCENARIOS)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Latency of each fake binary call, in seconds")
+    parser.add_argument("--lines", type=int, default=100,
+                        help="Output lines printed by each fake binary call")
+    parser.add_argument("--save", metavar="NAME", help="Saves results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="Compares results with a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Accepted relative increase on latency and memory")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenarios, args.repeat, args.latency, args.lines)
+
+    if args.save:
+        # Entries of scenarios that didn't run are kept, so that baselines are only updated for
+        # the scenarios whose behaviour changed
+        path = BASELINES_DIRECTORY / f"{args.save}.json"
+        saved = results
+        if path.exists():
+            with open(path) as baseline_file:
+                saved = dict(json.load(baseline_file)["results"], **results)
+            saved = {name: saved[name] for name in SCENARIOS if name in saved}
+        BASELINES_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as baseline_file:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "repeat": args.repeat,
+                    "latency": args.latency,
+                    "lines": args.lines,
+                },
+                "results": saved,
+            }, baseline_file, indent=4)
+            baseline_file.write("\n")
+    if args.compare:
+        with open(BASELINES_DIRECTORY / f"{args.compare}.json") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
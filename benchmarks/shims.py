@@ -0,0 +1,101 @@
+"""
+Fake terraform, helm, kubectl and git binaries for benchmarking datario_cli without real clusters.
+
+Each shim logs its invocation to `$DATARIO_BENCH_CALLS` (one JSON line per call), sleeps for
+`$DATARIO_BENCH_LATENCY` seconds and prints `$DATARIO_BENCH_LINES` lines of output. Both can be
+overriden per binary, e.g. `$DATARIO_BENCH_TERRAFORM_LATENCY`. Commands whose output is parsed by
+datario_cli answer with the minimal expected output.
+"""
+
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+SHIMS = ["git", "helm", "kubectl", "terraform"]
+
+SECRETS_NAMES = [
+    "gcp-sa",
+    "credentials-dev",
+    "credentials-prod",
+    "prefect-auth-toml",
+    "gcp-credentials",
+    "vault-credentials",
+]
+
+
+def install_shims(directory: Path) -> None:
+    """
+    Writes the shim executables to the given directory.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in SHIMS:
+        path = directory / name
+        path.write_text(
+            f"#!{sys.executable}\n"
+            "import sys\n"
+            f"sys.path.insert(0, {str(Path(__file__).parent)!r})\n"
+            "from shims import main\n"
+            f"main({name!r}, sys.argv[1:])\n"
+        )
+        path.chmod(0o755)
+
+
+def build_iac_fixture(directory: Path) -> None:
+    """
+    Creates a minimal iac-public tree, with the files read by datario_cli.
+    """
+    agent = directory / "prefect-agent"
+    for subdirectory in ["gke", "prefect-agent/manifests", "prefect-agent/prefect",
+                         "prefect-agent/basedosdados"]:
+        (directory / subdirectory).mkdir(parents=True, exist_ok=True)
+    (agent / "manifests" / "namespace.yaml").write_text(
+        "apiVersion: v1\nkind: Namespace\nmetadata:\n  name: prefect\n")
+    (agent / "manifests" / "secrets.yaml").write_text("---\n".join(
+        f"apiVersion: v1\nkind: Secret\nmetadata:\n  name: {name}\ndata: {{}}\n"
+        for name in SECRETS_NAMES
+    ))
+    (agent / "prefect" / "auth.toml").write_text(
+        '[cloud]\napi_key = "prefect-api-key"\ntenant_id = "prefect-tenant-id"\n')
+    (agent / "basedosdados" / "config.toml").write_text(
+        '[gcloud-projects]\nprod = "your-project-name"\n')
+    (agent / "values.yaml").write_text("agent:\n  image: prefect\n")
+
+
+def setting(name: str, key: str, default: str) -> str:
+    """
+    Reads a shim setting, preferring the binary specific variable.
+    """
+    return os.getenv(f"DATARIO_BENCH_{name.upper()}_{key}") or os.getenv(
+        f"DATARIO_BENCH_{key}") or default
+
+
+def main(name: str, args: list) -> None:
+    """
+    Entrypoint for the shims.
+    """
+    calls_path = os.getenv("DATARIO_BENCH_CALLS")
+    if calls_path:
+        with open(calls_path, "a") as calls_file:
+            calls_file.write(json.dumps({"binary": name, "argv": args, "cwd": os.getcwd()}) + "\n")
+    time.sleep(float(setting(name, "LATENCY", "0.01")))
+
+    command = " ".join(args)
+    if name == "git" and args[:1] == ["clone"]:
+        build_iac_fixture(Path(args[-1]))
+    elif name == "kubectl" and command == "config current-context":
+        print("fake-context")
+        return
+    elif name == "kubectl" and args[:1] == ["diff"]:
+        return
+    elif name == "helm" and args[:1] == ["status"]:
+        print("STATUS: deployed")
+    elif name == "helm" and args[:2] == ["search", "repo"]:
+        print(json.dumps([{"name": args[2], "version": "0.1.0", "app_version": "1.0"}]))
+        return
+    elif name == "terraform" and args[:1] in (["plan"], ["apply"], ["destroy"]):
+        print("No changes. 0 to add, 0 to change, 0 to destroy.")
+
+    lines = int(setting(name, "LINES", "100"))
+    sys.stdout.write(f"{name} {command}: fake output line\n" * lines)
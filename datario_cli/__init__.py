@@ -1,11 +1,18 @@
 __all__ = ["app"]
 __version__ = "0.1.1"
 
+# Dynamic shell completions are answered before importing the CLI, as TAB must respond quickly
+from datario_cli.completion import complete_early
+complete_early()
+
+# Imported next, so that profiling can account for import time
+from datario_cli import profiling  # noqa: F401
+
 import readline
 
 from datario_cli.cli import app
-from datario_cli.utils import autocomplete_paths
+from datario_cli.completion import path_completer
 
 readline.set_completer_delims(" \t\n;")
 readline.parse_and_bind("tab: complete")
-readline.set_completer(autocomplete_paths)
+readline.set_completer(path_completer)
@@ -0,0 +1,148 @@
+"""
+Record and replay of external commands and HTTP requests.
+
+Setting `DATARIO_CASSETTE_MODE=record` and `DATARIO_CASSETTE=<path>` captures every command run by
+`echo_and_run` and every request sent by `http_get` (arguments, exit code, timing and output,
+and the working directory of commands) into a JSON cassette. With `DATARIO_CASSETTE_MODE=replay`, those results are
+served from the cassette without starting any process or opening any connection, which allows
+running the orchestration logic on machines without terraform, helm or network access. Replay
+latency is controlled by `DATARIO_CASSETTE_LATENCY`, either `zero` (default) or `recorded`.
+
+The iac-public files read by datario_cli are captured as well, and replay restores them instead of
+running git, whatever the state of the local checkout. Configured credentials files aren't
+captured, so they must exist on the replaying machine. Neither are secrets read from Vault: they're
+always read from Vault itself, or from its encrypted cache.
+"""
+
+import atexit
+from collections import defaultdict, deque
+import json
+from os import getcwd, getenv
+from pathlib import Path
+import re
+from threading import Lock
+from time import sleep
+from typing import Dict, List, Optional
+
+from datario_cli.constants import Constants as constants
+
+CASSETTE_VERSION = 1
+
+# Commands run on another directory are prefixed with `cd <directory> &&`
+_CD_PREFIX = re.compile(r"^cd\s+(\S+)\s*&&")
+
+_LOCK = Lock()
+_STATE = {}
+
+
+class ReplayedResponse:
+    """
+    Minimal stand-in for `requests.Response`, built from a recorded interaction.
+    """
+
+    def __init__(self, interaction: Dict):
+        self.status_code = interaction["status_code"]
+        self.text = interaction["text"]
+        self.ok = self.status_code < 400
+
+
+def get_mode() -> Optional[str]:
+    """
+    Gets the cassette mode (`record`, `replay` or None), loading the cassette on first use.
+    """
+    with _LOCK:
+        if "mode" not in _STATE:
+            mode = getenv("DATARIO_CASSETTE_MODE") or None
+            path = getenv("DATARIO_CASSETTE")
+            if mode not in (None, "record", "replay"):
+                raise ValueError(f"Invalid DATARIO_CASSETTE_MODE: {mode}")
+            if mode and not path:
+                raise ValueError("DATARIO_CASSETTE must be set along with DATARIO_CASSETTE_MODE")
+            _STATE.update(mode=mode, path=path, interactions=[],
+                          queues=defaultdict(deque))
+            if mode == "record":
+                atexit.register(save)
+            elif mode == "replay":
+                with open(path) as cassette_file:
+                    for interaction in json.load(cassette_file)["interactions"]:
+                        key = (interaction["kind"], interaction["key"])
+                        _STATE["queues"][key].append(interaction)
+        return _STATE["mode"]
+
+
+def normalize(key: str) -> str:
+    """
+    Replaces machine specific paths on a key, so that cassettes can be replayed elsewhere.
+    """
+    return key.replace(str(constants.DATARIO_BASE_DIRECTORY.value), "{DATARIO_BASE_DIRECTORY}")
+
+
+def get_working_directory(command: str) -> str:
+    """
+    Gets the directory a command runs on, either the one it changes to or the current one.
+    """
+    match = _CD_PREFIX.match(command)
+    return normalize(match.group(1) if match else getcwd())
+
+
+def record(kind: str, key: str, duration: float, **data) -> None:
+    """
+    Adds an interaction to the cassette being recorded. Commands also get their working directory.
+    """
+    if kind == "subprocess":
+        data["cwd"] = get_working_directory(key)
+    with _LOCK:
+        _STATE["interactions"].append({
+            "kind": kind,
+            "key": normalize(key),
+            "duration": round(duration, 4),
+            **data,
+        })
+
+
+def replay(kind: str, key: str) -> Dict:
+    """
+    Gets the next recorded interaction for the given key, sleeping for its recorded duration if
+    `DATARIO_CASSETTE_LATENCY=recorded`.
+    """
+    with _LOCK:
+        queue = _STATE["queues"].get((kind, normalize(key)))
+        if not queue:
+            raise RuntimeError(f"No recorded {kind} interaction left for: {key}")
+        interaction = queue.popleft()
+    if getenv("DATARIO_CASSETTE_LATENCY", "zero") == "recorded":
+        sleep(interaction["duration"])
+    return interaction
+
+
+def record_tree(directory: Path, paths: List[Path]) -> None:
+    """
+    Adds the contents of the given files, relative to a directory, to the cassette being recorded.
+    """
+    record("tree", str(directory), 0, files={
+        str(Path(path).relative_to(directory)): Path(path).read_text()
+        for path in paths if Path(path).exists()
+    })
+
+
+def restore_tree(directory: Path) -> None:
+    """
+    Writes the recorded files of a directory back to it.
+    """
+    for name, content in replay("tree", str(directory))["files"].items():
+        path = Path(directory) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def save() -> None:
+    """
+    Saves the recorded cassette. Registered to run at exit when recording.
+    """
+    path = Path(_STATE["path"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _LOCK:
+        interactions: List[Dict] = list(_STATE["interactions"])
+    with open(path, "w") as cassette_file:
+        json.dump({"version": CASSETTE_VERSION, "interactions": interactions},
+                  cassette_file, indent=2)
@@ -1,5 +1,6 @@
-from typer import Typer
+from typer import BadParameter, Option, Typer
 
+from datario_cli.completion import complete_profiles
 from datario_cli.sub import (
     config,
     gke,
@@ -8,6 +9,41 @@ from datario_cli.sub import (
 
 app = Typer()
 
+
+@app.callback()
+def main(
+    profile: bool = Option(
+        False,
+        help="Records timings and exports them as a Chrome trace (or set DATARIO_PROFILE=1)",
+    ),
+    log_format: str = Option(
+        None, help="Log format, either text or json (or set DATARIO_LOG_FORMAT)"),
+    iac_ref: str = Option(
+        None, help="iac-public revision to use, on its own worktree (or set DATARIO_IAC_REF)"),
+    environments_file: str = Option(
+        None,
+        help="Configurations profile to use (or set DATARIO_ENVIRONMENTS_FILE)",
+        autocompletion=complete_profiles,
+    ),
+):
+    """
+    Escritório de Dados Rio CLI Tool
+    """
+    from os import environ
+    from datario_cli import logger, profiling
+    from datario_cli.constants import expand_path
+    if log_format:
+        if log_format not in logger.LOG_FORMATS:
+            raise BadParameter(
+                f"{log_format!r} is not one of {logger.LOG_FORMATS}", param_hint="--log-format")
+        logger.configure(log_format)
+    if iac_ref:
+        environ["DATARIO_IAC_REF"] = iac_ref
+    if environments_file:
+        environ["DATARIO_ENVIRONMENTS_FILE"] = expand_path(environments_file)
+    if profile or profiling.is_requested():
+        profiling.enable()
+
 app.add_typer(
     gke.app,
     name="gke",
@@ -34,6 +70,19 @@ def version():
     print(f"datario-cli version {__version__}")
 
 
+@app.command()
+def run(
+    runbook: str,
+    resume: bool = Option(False, help="Skips steps that succeeded on the last run"),
+    max_workers: int = Option(None, help="Maximum number of steps running in parallel"),
+):
+    """Runs the steps described in a runbook file"""
+    from sys import exit
+    from datario_cli.runbook import run_runbook
+    if not run_runbook(runbook, resume=resume, max_workers=max_workers):
+        exit(1)
+
+
 @app.command()
 def upgrade():
     """Upgrade datario-cli"""
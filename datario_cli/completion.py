@@ -0,0 +1,229 @@
+"""
+Completion for interactive prompts and shell completion for dynamic arguments.
+
+Shell completion of dynamic options (kube contexts and configuration profiles) is answered by
+`complete_early`, before the CLI and its dependencies get imported. Other completions go through
+Typer as usual.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import re
+import shlex
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from datario_cli.constants import Constants as constants
+
+
+class PathCompleter:
+    """
+    Readline completer for filesystem paths. Each directory is listed once per prefix, and the
+    sorted candidates are cached until the prefix changes. Directories get a trailing `/` and files
+    with the preferred suffix (if any) are listed first.
+    """
+
+    def __init__(self):
+        self.preferred_suffix: Optional[str] = None
+        self._key = None
+        self._candidates: List[str] = []
+
+    def __call__(self, text: str, state: int) -> Optional[str]:
+        key = (text, self.preferred_suffix)
+        if key != self._key:
+            self._candidates = self.list_candidates(text)
+            self._key = key
+        if state < len(self._candidates):
+            return self._candidates[state]
+        return None
+
+    def list_candidates(self, text: str) -> List[str]:
+        """
+        Lists the paths that complete the given text.
+        """
+        dirname, basename = os.path.split(text)
+        directory = os.path.expanduser(dirname) if dirname else "."
+        candidates = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(basename):
+                        continue
+                    if entry.name.startswith(".") and not basename.startswith("."):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    candidate = os.path.join(dirname, entry.name)
+                    candidates.append(candidate + "/" if is_dir else candidate)
+        except OSError:
+            return []
+        suffix = self.preferred_suffix
+        return sorted(
+            candidates,
+            key=lambda candidate: (not (suffix and candidate.endswith(suffix)), candidate),
+        )
+
+    @contextmanager
+    def preferring(self, suffix: Optional[str]):
+        """
+        Context manager that lists files with the given suffix first while it is active.
+        """
+        previous = self.preferred_suffix
+        self.preferred_suffix = suffix
+        try:
+            yield
+        finally:
+            self.preferred_suffix = previous
+            self._key = None
+
+
+path_completer = PathCompleter()
+
+
+def get_kubeconfig_paths() -> List[Path]:
+    """
+    Gets the kubeconfig files in use, following the `KUBECONFIG` environment variable like kubectl.
+    """
+    kubeconfig = os.getenv("KUBECONFIG")
+    if kubeconfig:
+        return [Path(path).expanduser() for path in kubeconfig.split(os.pathsep) if path]
+    return [Path.home() / ".kube" / "config"]
+
+
+def load_kube_contexts() -> Dict:
+    """
+    Parses the kubeconfig files in-process, returning their contexts and the current context.
+    Results are cached on disk, keyed by the kubeconfig files modification times.
+    """
+    stamps = {}
+    for path in get_kubeconfig_paths():
+        try:
+            stamps[str(path)] = path.stat().st_mtime_ns
+        except OSError:
+            continue
+    cache_path = constants.DATARIO_CACHE_DIRECTORY.value / "kube-contexts.json"
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if cache["stamps"] == stamps:
+            return cache
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    contexts = []
+    current_context = None
+    for path in stamps:
+        try:
+            with open(path) as kubeconfig_file:
+                kubeconfig = yaml.load(kubeconfig_file, Loader=loader) or {}
+        except (OSError, yaml.YAMLError):
+            continue
+        for context in kubeconfig.get("contexts") or []:
+            if context.get("name") and context["name"] not in contexts:
+                contexts.append(context["name"])
+        # Like kubectl, the first file that sets the current context wins
+        current_context = current_context or kubeconfig.get("current-context")
+    cache = {"stamps": stamps, "contexts": contexts, "current_context": current_context}
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as cache_file:
+            json.dump(cache, cache_file)
+    except OSError:
+        pass
+    return cache
+
+
+def complete_kube_contexts(incomplete: str) -> List[str]:
+    """
+    Shell completion for kube contexts, reading the kubeconfig instead of running kubectl.
+    """
+    return [
+        context for context in load_kube_contexts()["contexts"]
+        if context.startswith(incomplete)
+    ]
+
+
+def complete_profiles(incomplete: str) -> List[str]:
+    """
+    Shell completion for configuration profiles, i.e. the environments files (`envs*.json`) on the
+    datario base directory.
+    """
+    return [
+        str(path) for path in sorted(constants.DATARIO_BASE_DIRECTORY.value.glob("envs*.json"))
+        if str(path).startswith(incomplete)
+    ]
+
+
+# Options completed by `complete_early`
+EARLY_COMPLETERS = {
+    "--context": complete_kube_contexts,
+    "--environments-file": complete_profiles,
+}
+
+
+def get_completion_request() -> Optional[Tuple[str, List[str], str]]:
+    """
+    Gets the shell, the previous words and the incomplete word of a shell completion request, if
+    this process was started for one. Follows the protocol of Typer's completion scripts.
+    """
+    shell = next((
+        value[len("complete_"):] for name, value in os.environ.items()
+        if re.match(r"^_\w+_COMPLETE$", name) and value.startswith("complete_")
+    ), None)
+    if shell is None:
+        return None
+    try:
+        if shell == "bash":
+            words = shlex.split(os.getenv("COMP_WORDS", ""))
+            cword = int(os.getenv("COMP_CWORD", "0"))
+            return shell, words[1:cword], words[cword] if cword < len(words) else ""
+        line = os.getenv("_TYPER_COMPLETE_ARGS", "")
+        words = shlex.split(line)[1:]
+    except ValueError:
+        return None
+    if shell in ("powershell", "pwsh"):
+        return shell, words, os.getenv("_TYPER_COMPLETE_WORD_TO_COMPLETE", "")
+    if words and not line.endswith(" "):
+        return shell, words[:-1], words[-1]
+    return shell, words, ""
+
+
+def format_completions(shell: str, values: List[str]) -> str:
+    """
+    Formats completions like Typer does for each shell.
+    """
+    if shell == "zsh":
+        if not values:
+            return "_files"
+        escaped = [
+            value.replace('"', '""').replace("'", "''").replace("$", "\\$").replace("`", "\\`")
+            for value in values
+        ]
+        return "_arguments '*: :((" + "\n".join(f'"{value}"' for value in escaped) + "))'"
+    if shell in ("powershell", "pwsh"):
+        return "\n".join(f"{value}::: " for value in values)
+    return "\n".join(values)
+
+
+def complete_early() -> None:
+    """
+    Answers shell completion requests for the options in `EARLY_COMPLETERS` and exits. Returns
+    for anything else, leaving it to Typer.
+    """
+    request = get_completion_request()
+    if request is None:
+        return
+    shell, words, incomplete = request
+    if not words or words[-1] not in EARLY_COMPLETERS:
+        return
+    values = EARLY_COMPLETERS[words[-1]](incomplete)
+    if shell == "fish" and os.getenv("_TYPER_COMPLETE_FISH_ACTION") == "is-args":
+        sys.exit(0 if values else 1)
+    sys.stdout.write(format_completions(shell, values))
+    sys.exit(0)
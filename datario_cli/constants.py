@@ -13,25 +13,46 @@ def expand_path(path: str) -> str:
     return str(Path(path.strip()).expanduser().resolve())
 
 
+def expand_credentials_path(path: str) -> str:
+    """
+    Expands the given path, unless it's a Vault reference (`vault:<path>#<field>`)
+    """
+    if path.strip().startswith("vault:"):
+        return path.strip()
+    return expand_path(path)
+
+
 class Constants (Enum):
     """
     All constants for the datario CLI tool.
     """
+    DATARIO_PREFECT_API_ADDRESS = "https://prefect.dados.rio/api"
     DATARIO_VAULT_EXTERNAL_ADDRESS = "https://vault.dados.rio/"
+    DATARIO_VAULT_CACHE_TTL = 3600
     DATARIO_BASE_DIRECTORY = Path.home() / ".datario"
+    DATARIO_CACHE_DIRECTORY = DATARIO_BASE_DIRECTORY / "cache"
+    DATARIO_DOCTOR_CACHE_FILE = DATARIO_CACHE_DIRECTORY / "doctor.json"
+    DATARIO_VAULT_CACHE_FILE = DATARIO_CACHE_DIRECTORY / "vault.bin"
     DATARIO_ENVIRONMENTS_FILE = DATARIO_BASE_DIRECTORY / "envs.json"
+    DATARIO_HISTORY_FILE = DATARIO_BASE_DIRECTORY / "history.json"
+    DATARIO_RUNS_DIRECTORY = DATARIO_BASE_DIRECTORY / "runs"
+    DATARIO_SNAPSHOTS_DIRECTORY = DATARIO_BASE_DIRECTORY / "snapshots"
+    DATARIO_TRACES_DIRECTORY = DATARIO_BASE_DIRECTORY / "traces"
     DATARIO_ENVIRONMENTS_LIST = {
         "BASEDOSDADOS_CREDENTIALS_PROD_PATH": {
             "prompt_text": "Caminho para o arquivo de credenciais do ambiente prod da BD+",
-            "callback_function": expand_path,
+            "callback_function": expand_credentials_path,
+            "completion_suffix": ".json",
         },
         "BASEDOSDADOS_CREDENTIALS_STAGING_PATH": {
             "prompt_text": "Caminho para o arquivo de credenciais do ambiente staging da BD+",
-            "callback_function": expand_path,
+            "callback_function": expand_credentials_path,
+            "completion_suffix": ".json",
         },
         "GOOGLE_APPLICATION_CREDENTIALS": {
             "prompt_text": "Caminho para o arquivo de credenciais da GCP",
             "callback_function": expand_path,
+            "completion_suffix": ".json",
         },
         "TF_VAR_bucket_name": {
             "prompt_text": "Nome do bucket da GCP para armazenamento do estado do Terraform",
@@ -89,8 +110,13 @@ class Constants (Enum):
             "💽",
         ],
     }
+    TERRAFORM_PLUGIN_CACHE_DIRECTORY = DATARIO_BASE_DIRECTORY / "terraform-plugin-cache"
+    TERRAFORM_PLUGIN_CACHE_MAX_BYTES = 2 * 1024 ** 3
     IAC_DIRECTORY = DATARIO_BASE_DIRECTORY / "iac-public"
     IAC_GIT_REPOSITORY = "https://github.com/prefeitura-rio/iac-public.git/"
+    IAC_MAX_WORKTREES = 5
+    IAC_OBJECT_STORE_DIRECTORY = DATARIO_BASE_DIRECTORY / "iac-public.git"
+    IAC_WORKTREES_DIRECTORY = DATARIO_BASE_DIRECTORY / "iac-public-worktrees"
     IAC_PREFECT_AUTH_TOML_PATH = IAC_DIRECTORY / \
         "prefect-agent" / "prefect" / "auth.toml"
     IAC_PREFECT_BD_CONFIG_BASE_PATH = IAC_DIRECTORY / \
@@ -0,0 +1,168 @@
+"""
+Validation of the configured inputs.
+
+Each entry of `DATARIO_ENVIRONMENTS_LIST` has a check: credentials files must exist, parse and
+match `TF_VAR_project_id`, and ids and tokens are expected to be well-formed. Vault references are
+only checked for their syntax, as resolving them needs the network. Problems are either errors,
+which make commands fail, or warnings for the heuristics (formats may have exceptions, like legacy
+or dev-mode tokens). Checks run concurrently, and their results are cached by the hash of their
+inputs (including file contents), so that commands can run them up front at near-zero cost.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+from os import getenv
+from pathlib import Path
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from datario_cli.constants import Constants as constants
+from datario_cli.logger import log
+from datario_cli.utils import build_directory_tree
+from datario_cli.vault import is_reference, parse_reference
+
+_BUCKET_NAME = re.compile(r"^[a-z0-9][a-z0-9_.-]{1,61}[a-z0-9]$")
+_PROJECT_ID = re.compile(r"^[a-z][a-z0-9-]{4,28}[a-z0-9]$")
+_VAULT_TOKEN = re.compile(r"^(hv[sbr]|[sbr])\.[\w.-]{20,}$")
+_PREFECT_TOKEN = re.compile(r"^\S{16,}$")
+
+# Bumped when checks change, so that cached results get discarded
+CACHE_VERSION = 2
+
+# A problem is a level (`error` or `warning`) and a message
+Problem = Tuple[str, str]
+
+
+def check_credentials_file(value: str, project_id: Optional[str] = None) -> List[Problem]:
+    """
+    Checks a service account credentials file, optionally matching its project with the given one.
+    """
+    path = Path(value)
+    if not path.is_file():
+        return [("error", f"Arquivo não encontrado: {value}")]
+    try:
+        credentials = json.loads(path.read_text())
+    except ValueError as exc:
+        return [("error", f"Arquivo não é um JSON válido ({exc}): {value}")]
+    if not isinstance(credentials, dict):
+        return [("error", f"Arquivo não contém um objeto JSON: {value}")]
+    problems = [("warning", f"Campo {field} faltando em {value}")
+                for field in ["type", "project_id", "client_email"] if not credentials.get(field)]
+    if project_id and credentials.get("project_id") and credentials["project_id"] != project_id:
+        problems.append(("error", f"project_id {credentials['project_id']} do arquivo não"
+                                  f" corresponde ao TF_VAR_project_id {project_id}"))
+    return problems
+
+
+def check_pattern(pattern: re.Pattern, description: str) -> Callable[[str], List[Problem]]:
+    """
+    Builds a check that the value matches the given pattern.
+    """
+    return lambda value: [] if pattern.match(value) else [
+        ("warning", f"Formato inesperado para {description}")]
+
+
+def check_uuid(value: str) -> List[Problem]:
+    """
+    Checks that the value is a UUID.
+    """
+    try:
+        UUID(value)
+    except ValueError:
+        return [("warning", "Formato inesperado para um UUID")]
+    return []
+
+
+CHECKS = {
+    "BASEDOSDADOS_CREDENTIALS_PROD_PATH": check_credentials_file,
+    "BASEDOSDADOS_CREDENTIALS_STAGING_PATH": check_credentials_file,
+    "GOOGLE_APPLICATION_CREDENTIALS": lambda value: check_credentials_file(
+        value, getenv("TF_VAR_project_id")),
+    "TF_VAR_bucket_name": check_pattern(_BUCKET_NAME, "um nome de bucket da GCP"),
+    "TF_VAR_project_id": check_pattern(_PROJECT_ID, "um ID de projeto da GCP"),
+    "VAULT_TOKEN": check_pattern(_VAULT_TOKEN, "um token do Vault"),
+    "PREFECT_TOKEN": check_pattern(_PREFECT_TOKEN, "um token do Prefect"),
+    "PREFECT_TENANT_ID": check_uuid,
+}
+
+# Other variables read by each check, which must be part of its cache key
+DEPENDENCIES = {
+    "GOOGLE_APPLICATION_CREDENTIALS": ["TF_VAR_project_id"],
+}
+
+
+def check_entry(name: str, value: Optional[str]) -> List[Problem]:
+    """
+    Runs the check of a configuration entry, returning the problems found.
+    """
+    if not value:
+        return [("error", "Não configurado")]
+    if is_reference(value):
+        try:
+            parse_reference(value)
+        except ValueError as exc:
+            return [("error", str(exc))]
+        return []
+    return CHECKS[name](value)
+
+
+def cache_key(name: str, value: Optional[str]) -> str:
+    """
+    Hashes the inputs of a check: the value, the contents of the file it points to, if any, and
+    the variables it depends on.
+    """
+    digest = hashlib.sha256(json.dumps(
+        [CACHE_VERSION, name, value]
+        + [getenv(dependency) for dependency in DEPENDENCIES.get(name, [])]
+    ).encode("utf-8"))
+    if value and not is_reference(value) and Path(value).is_file():
+        digest.update(Path(value).read_bytes())
+    return digest.hexdigest()
+
+
+def run_checks(names: List[str]) -> Dict[str, List[Problem]]:
+    """
+    Runs the checks of the given configuration entries concurrently, reusing cached results.
+    Returns the problems found for each entry.
+    """
+    path = Path(constants.DATARIO_DOCTOR_CACHE_FILE.value)
+    try:
+        cache = json.loads(path.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    values = {name: getenv(name) for name in names}
+    with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+        keys = dict(zip(names, executor.map(lambda name: cache_key(name, values[name]), names)))
+        stale = [name for name in names if cache.get(name, {}).get("key") != keys[name]]
+        for name, problems in zip(stale, executor.map(
+                lambda name: check_entry(name, values[name]), stale)):
+            cache[name] = {"key": keys[name], "problems": problems}
+    if stale:
+        build_directory_tree(path.parent)
+        path.write_text(json.dumps(cache, indent=2))
+    return {
+        name: [(level, message) for level, message in cache[name]["problems"]]
+        for name in names
+    }
+
+
+def check_configuration(names: List[str]) -> None:
+    """
+    Asserts that the given configuration entries are valid, skipping the ones that aren't set.
+    Warnings are only logged. If there are errors, raise them to the user.
+    """
+    INITIAL_MESSAGE = "Configurações inválidas (veja `datario config doctor`):"
+    msg = INITIAL_MESSAGE
+
+    for name, problems in run_checks([name for name in names if getenv(name)]).items():
+        for level, problem in problems:
+            if level == "error":
+                msg += f"\n  * {name}: {problem}"
+            else:
+                log(f"{name}: {problem} (veja `datario config doctor`)", "warning")
+
+    if msg != INITIAL_MESSAGE:
+        log(msg, "error")
+        raise Exception(msg)
@@ -0,0 +1,112 @@
+"""
+Local drift detection against snapshots of what was last applied to each context.
+
+Snapshots only keep hashes of each field, so that secrets never get written to them.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+import re
+from time import time
+from typing import Any, Dict, List, Optional
+
+from datario_cli import cassette
+from datario_cli.constants import Constants as constants
+from datario_cli.utils import build_directory_tree
+
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, Any]:
+    """
+    Flattens nested dicts and lists into a dict of dotted paths to leaf values.
+    """
+    if isinstance(value, dict) and value:
+        items = value.items()
+    elif isinstance(value, list) and value:
+        items = ((f"[{index}]", item) for index, item in enumerate(value))
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, item in items:
+        path = f"{prefix}{key}" if str(key).startswith("[") or not prefix else f"{prefix}.{key}"
+        flat.update(flatten(item, path))
+    return flat
+
+
+def fingerprint(value: Any) -> Dict[str, str]:
+    """
+    Builds the field-level fingerprint of a value: its flattened paths mapped to value hashes.
+    """
+    return {
+        path: hashlib.sha256(json.dumps(leaf, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        for path, leaf in flatten(value).items()
+    }
+
+
+def snapshot_path(context: str) -> Path:
+    """
+    Gets the path of the snapshot of a context.
+    """
+    name = re.sub(r"[^\w.-]", "_", context)
+    return constants.DATARIO_SNAPSHOTS_DIRECTORY.value / f"{name}.json"
+
+
+def save_snapshot(context: str, **sections: Any) -> None:
+    """
+    Saves the fingerprints of each given section as the last applied state of a context. Nothing
+    is saved when replaying a cassette, as nothing was applied.
+    """
+    if cassette.get_mode() == "replay":
+        return
+    path = snapshot_path(context)
+    build_directory_tree(path.parent)
+    with open(path, "w") as snapshot_file:
+        json.dump({
+            "context": context,
+            "applied_at": int(time()),
+            "sections": {name: fingerprint(value) for name, value in sections.items()},
+        }, snapshot_file, indent=2)
+
+
+def load_snapshot(context: str) -> Optional[Dict]:
+    """
+    Loads the snapshot of a context, if there's one.
+    """
+    path = snapshot_path(context)
+    if not path.exists():
+        return None
+    with open(path) as snapshot_file:
+        return json.load(snapshot_file)
+
+
+def delete_snapshot(context: str) -> None:
+    """
+    Deletes the snapshot of a context, once what was applied to it is removed. Nothing is deleted
+    when replaying a cassette.
+    """
+    if cassette.get_mode() == "replay":
+        return
+    snapshot_path(context).unlink(missing_ok=True)
+
+
+def diff_snapshot(context: str, **sections: Any) -> Optional[List[str]]:
+    """
+    Compares the given sections with the snapshot of a context, returning the changed fields
+    (like `~ secrets.gcp-sa.data.creds.json`) or None if there's no snapshot.
+    """
+    snapshot = load_snapshot(context)
+    if snapshot is None:
+        return None
+    changes = []
+    for name, value in sections.items():
+        current = fingerprint(value)
+        applied = snapshot["sections"].get(name, {})
+        for path in sorted(set(current) | set(applied)):
+            field = f"{name}.{path}" if path else name
+            if path not in applied:
+                changes.append(f"+ {field}")
+            elif path not in current:
+                changes.append(f"- {field}")
+            elif current[path] != applied[path]:
+                changes.append(f"~ {field}")
+    return changes
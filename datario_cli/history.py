@@ -0,0 +1,150 @@
+"""
+Historical step durations, used to display ETAs for long operations.
+
+Durations are stored per project, context and step on a compact JSON file under the datario base
+directory, keeping only the most recent samples of the most recently used steps.
+"""
+
+from contextlib import contextmanager
+import json
+from os import getenv, replace
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from typing import Dict, List
+
+from datario_cli import cassette
+from datario_cli.constants import Constants as constants
+from datario_cli.logger import log
+from datario_cli.profiling import span
+
+MAX_SAMPLES = 30
+MAX_STEPS = 200
+MIN_ETA_DURATION = 10
+TICK_INTERVAL = 30
+
+_LOCK = Lock()
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a duration in seconds as a short human readable string.
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Computes the q-th percentile (0 to 100) of the given values, with linear interpolation.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def step_key(step: str, context: str = None) -> str:
+    """
+    Builds the key of a step for the current project and the given context.
+    """
+    return f'{getenv("TF_VAR_project_id") or "-"}|{context or "-"}|{step}'
+
+
+def load_history(path: Path = None) -> Dict[str, Dict]:
+    """
+    Loads the step durations history.
+    """
+    path = Path(path or constants.DATARIO_HISTORY_FILE.value)
+    if not path.exists():
+        return {}
+    try:
+        with open(path) as history_file:
+            return json.load(history_file)
+    except ValueError:
+        return {}
+
+
+def get_durations(step: str, context: str = None) -> List[float]:
+    """
+    Gets the recorded durations of a step, oldest first.
+    """
+    return load_history().get(step_key(step, context), {}).get("durations", [])
+
+
+def record_duration(step: str, duration: float, context: str = None, path: Path = None) -> None:
+    """
+    Records the duration of a step, evicting old samples and the least recently used steps.
+    Replayed steps aren't recorded, as their durations aren't real.
+    """
+    if cassette.get_mode() == "replay":
+        return
+    path = Path(path or constants.DATARIO_HISTORY_FILE.value)
+    with _LOCK:
+        history = load_history(path)
+        entry = history.setdefault(step_key(step, context), {"durations": []})
+        entry["durations"] = (entry["durations"] + [round(duration, 1)])[-MAX_SAMPLES:]
+        entry["updated"] = int(time())
+        if len(history) > MAX_STEPS:
+            keys = sorted(history, key=lambda key: history[key]["updated"])
+            for key in keys[:len(history) - MAX_STEPS]:
+                del history[key]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as history_file:
+            json.dump(history, history_file, separators=(",", ":"))
+        replace(tmp_path, path)
+
+
+def watch_step(step: str, durations: List[float], start: float, stop: Event) -> None:
+    """
+    Periodically logs the elapsed time and ETA of a running step, warning once if it is slower
+    than usual.
+    """
+    expected = percentile(durations, 50)
+    slow = percentile(durations, 90)
+    warned = False
+    while not stop.wait(TICK_INTERVAL):
+        elapsed = perf_counter() - start
+        if elapsed > slow and not warned:
+            log(f"⏳ {step} está mais lento que o normal: {format_duration(elapsed)} decorridos,"
+                f" 90% das execuções anteriores levaram até {format_duration(slow)}.", "warning")
+            warned = True
+        elif elapsed < expected:
+            log(f"⏳ {step}: {format_duration(elapsed)} decorridos,"
+                f" ~{format_duration(expected - elapsed)} restantes.")
+        else:
+            log(f"⏳ {step}: {format_duration(elapsed)} decorridos.")
+
+
+@contextmanager
+def tracked_step(step: str, context: str = None):
+    """
+    Context manager that times a step, shows its ETA from previous runs while it runs and records
+    its duration when it succeeds.
+    """
+    durations = get_durations(step, context)
+    stop = Event()
+    start = perf_counter()
+    if durations and percentile(durations, 50) >= MIN_ETA_DURATION:
+        log(f"⏳ {step} costuma levar ~{format_duration(percentile(durations, 50))}"
+            f" (até {format_duration(percentile(durations, 90))} em 90% das vezes).")
+        Thread(target=watch_step, args=(step, durations, start, stop), daemon=True).start()
+    try:
+        with span(step, "step", context=context):
+            yield
+    except SystemExit as exc:
+        if not exc.code:
+            record_duration(step, perf_counter() - start, context)
+        raise
+    else:
+        record_duration(step, perf_counter() - start, context)
+    finally:
+        stop.set()
@@ -0,0 +1,154 @@
+"""
+Management of the iac-public repository checkouts.
+
+By default, a single checkout at `IAC_DIRECTORY` is kept on the tip of the default branch. When a
+revision is requested (`datario --iac-ref <ref>` or `DATARIO_IAC_REF`), a bare object store is
+kept instead, with one lightweight worktree per revision. Worktrees keep their generated files
+and initialized terraform directories, and the least recently used ones are evicted.
+"""
+
+from os import getenv, utime
+from pathlib import Path
+import re
+import shlex
+from typing import Optional
+
+from datario_cli import cassette
+from datario_cli.constants import Constants as constants
+from datario_cli.logger import log
+from datario_cli.utils import (
+    build_directory_tree,
+    echo_and_run,
+    random_emoji,
+    run_once,
+    update_git_repo,
+)
+
+_FULL_COMMIT_SHA = re.compile(r"^[0-9a-f]{40}$")
+
+# Files read from the checkout, captured on recorded cassettes
+INPUT_FILES = [
+    constants.IAC_PREFECT_AUTH_TOML_PATH,
+    constants.IAC_PREFECT_BD_CONFIG_BASE_PATH,
+    constants.IAC_PREFECT_NAMESPACE_PATH,
+    constants.IAC_PREFECT_SECRETS_BASE_PATH,
+    constants.IAC_PREFECT_VALUES_BASE_PATH,
+]
+
+
+def get_iac_ref() -> Optional[str]:
+    """
+    Gets the requested iac-public revision, if any.
+    """
+    return getenv("DATARIO_IAC_REF") or None
+
+
+def get_iac_directory() -> Path:
+    """
+    Gets the directory of the iac-public checkout in use.
+    """
+    ref = get_iac_ref()
+    if not ref:
+        return constants.IAC_DIRECTORY.value
+    return constants.IAC_WORKTREES_DIRECTORY.value / re.sub(r"[^\w.-]", "_", ref)
+
+
+def get_iac_path(constant: constants) -> Path:
+    """
+    Gets the path of one of the `IAC_*` constants on the iac-public checkout in use.
+    """
+    return get_iac_directory() / Path(constant.value).relative_to(constants.IAC_DIRECTORY.value)
+
+
+def git(arguments: str, **kwargs) -> int:
+    """
+    Runs a git command on the iac-public object store.
+    """
+    kwargs.setdefault("stdout_callback", lambda _: None)
+    return echo_and_run(
+        f"git --git-dir={constants.IAC_OBJECT_STORE_DIRECTORY.value} {arguments}", **kwargs)
+
+
+def is_mutable_ref(ref: str) -> bool:
+    """
+    Asserts that the given ref may move on the remote, i.e. it's a branch or it's not known yet.
+    Full commit hashes and tags are immutable.
+    """
+    if _FULL_COMMIT_SHA.match(ref):
+        return git(f"cat-file -e {ref}^{{commit}}", on_error="return") != 0
+    if git(f"show-ref --verify --quiet refs/tags/{shlex.quote(ref)}", on_error="return") == 0:
+        return False
+    return True
+
+
+def checkout_worktree(ref: str) -> Path:
+    """
+    Checks out the given ref on its own worktree, creating the object store and fetching from the
+    remote only when needed.
+    """
+    store = constants.IAC_OBJECT_STORE_DIRECTORY.value
+    directory = get_iac_directory()
+    repository = getenv("DATARIO_IAC_GIT_REPOSITORY") or constants.IAC_GIT_REPOSITORY.value
+    if not store.exists():
+        build_directory_tree(store.parent)
+        echo_and_run(f"git clone --bare {repository} {store}", stdout_callback=lambda _: None)
+    elif is_mutable_ref(ref):
+        git("fetch --prune origin '+refs/heads/*:refs/heads/*' '+refs/tags/*:refs/tags/*'")
+    elif directory.exists():
+        utime(directory)
+        return directory
+    if directory.exists():
+        echo_and_run(f"git -C {directory} checkout --detach {shlex.quote(ref)}",
+                     stdout_callback=lambda _: None)
+    else:
+        build_directory_tree(directory.parent)
+        git(f"worktree add --detach {directory} {shlex.quote(ref)}")
+    utime(directory)
+    return directory
+
+
+def evict_worktrees(max_worktrees: int = None) -> None:
+    """
+    Removes the least recently used worktrees, keeping at most `max_worktrees` (defaults to
+    `DATARIO_IAC_MAX_WORKTREES`).
+    """
+    max_worktrees = max_worktrees or int(
+        getenv("DATARIO_IAC_MAX_WORKTREES") or constants.IAC_MAX_WORKTREES.value)
+    directories = sorted(
+        (path for path in constants.IAC_WORKTREES_DIRECTORY.value.iterdir() if path.is_dir()),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    evicted = False
+    for directory in directories[max_worktrees:]:
+        if directory == get_iac_directory():
+            continue
+        log(f'{random_emoji("technology")} Removendo worktree antiga: {directory}')
+        git(f"worktree remove --force {directory}", on_error="return")
+        evicted = True
+    if evicted:
+        git("worktree prune")
+
+
+@run_once
+def update_iac_repository() -> Path:
+    """
+    Updates the iac-public checkout in use, returning its directory. When replaying a cassette,
+    the recorded files are restored instead.
+    """
+    ref = get_iac_ref()
+    directory = get_iac_directory()
+    mode = cassette.get_mode()
+    if mode == "replay":
+        cassette.restore_tree(directory)
+        return directory
+    if not ref:
+        update_git_repo()
+    else:
+        log(f'{random_emoji("technology")} Usando a revisão {ref} do iac-public')
+        checkout_worktree(ref)
+        evict_worktrees()
+    if mode == "record":
+        cassette.record_tree(directory, [get_iac_path(constant) for constant in INPUT_FILES]
+                             + [directory / "gke" / ".terraform.lock.hcl"])
+    return directory
@@ -1,37 +1,100 @@
 """
 Logger module for datario_cli.
+
+Loguru is only configured on the first log call, and emoji codes are resolved once: the ones in
+`Constants.EMOJIS` through a precomputed table, others only when a message contains one. Output
+of passthrough commands doesn't go through the logger, it's written in batches by `write_output`.
 """
 
+from functools import lru_cache
+from os import getenv
+import re
 import sys
+from threading import Lock
+from typing import Callable, Dict, List
 
-import emoji
-from loguru import logger
+from datario_cli.constants import Constants as constants
 
 fmt = (
     # "<blue>{time:YYYY-MM-DD HH:mm:ss.SSS}</blue> | "
     # "<level>{level: <8}</level> | "
     "<level>{message}</level>"
 )
-config = {
-    "handlers": [
-        {"sink": sys.stderr, "format": fmt},
-    ]
-}
-logger.configure(**config)
+LEVELS = ["debug", "info", "success", "warning", "error"]
+LOG_FORMATS = ["text", "json"]
+
+_EMOJI_CODE = re.compile(r":[^\s:]+:")
+_LOCK = Lock()
+_STATE = {}
+
+
+def configure(log_format: str = None) -> Dict[str, Callable]:
+    """
+    Configures the logger, either with human readable (`text`) or JSON lines (`json`) output.
+    JSON logs are written asynchronously, from a queue. Defaults to `DATARIO_LOG_FORMAT`.
+    """
+    from loguru import logger
+    log_format = log_format or getenv("DATARIO_LOG_FORMAT") or "text"
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Invalid log format: {log_format}")
+    _STATE["format"] = log_format
+    if log_format == "json":
+        handler = {"sink": sys.stderr, "serialize": True, "enqueue": True}
+    else:
+        handler = {"sink": sys.stderr, "format": fmt}
+    logger.configure(handlers=[handler])
+    _STATE["funcs"] = {level: getattr(logger, level) for level in LEVELS}
+    return _STATE["funcs"]
+
+
+def get_format() -> str:
+    """
+    Gets the log format in use, or the one the logger will be configured with.
+    """
+    return _STATE.get("format") or getenv("DATARIO_LOG_FORMAT") or "text"
+
+
+@lru_cache(maxsize=None)
+def get_emojis(category: str) -> List[str]:
+    """
+    Gets the emojis of a category of `Constants.EMOJIS`, with their codes already resolved.
+    """
+    return [emojize(code) for code in constants.EMOJIS.value[category]]
+
+
+def emojize(message: str) -> str:
+    """
+    Replaces emoji codes (like `:rocket:`) on the message.
+    """
+    if not _EMOJI_CODE.search(message):
+        return message
+    import emoji
+    return emoji.emojize(message)
 
 
 def log(message, level="info"):
     """
     Log a message.
     """
-    funcs = {
-        "debug": logger.debug,
-        "info": logger.info,
-        "success": logger.success,
-        "warning": logger.warning,
-        "error": logger.error,
-    }
+    funcs = _STATE.get("funcs")
+    if funcs is None:
+        with _LOCK:
+            funcs = _STATE.get("funcs") or configure()
     if level not in funcs:
-        logger.error(f"Invalid log level: {level}")
+        funcs["error"](f"Invalid log level: {level}")
         raise ValueError(f"Invalid log level: {level}")
-    funcs[level](emoji.emojize(message))
+    funcs[level](emojize(message))
+
+
+def write_output(data: bytes) -> None:
+    """
+    Writes a batch of command output straight to stdout.
+    """
+    sys.stdout.flush()
+    stream = getattr(sys.stdout, "buffer", None)
+    if stream is None:
+        sys.stdout.write(data.decode("utf-8", "replace"))
+        sys.stdout.flush()
+        return
+    stream.write(data)
+    stream.flush()
@@ -0,0 +1,164 @@
+"""
+Timing instrumentation for datario_cli.
+
+Spans are only recorded when profiling is enabled, either with `datario --profile` or by setting
+`DATARIO_PROFILE=1`. At exit, spans are exported to a Chrome trace-event JSON file (open it on
+chrome://tracing or https://ui.perfetto.dev) and summarized per step, unless logs are JSON lines.
+"""
+
+import atexit
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+from os import getenv, getpid
+from pathlib import Path
+import sys
+from threading import Lock, get_ident
+from time import perf_counter
+from typing import Callable, Dict, List
+
+_ORIGIN = perf_counter()
+_SPANS: List[Dict] = []
+_SPANS_LOCK = Lock()
+_STATE = {"enabled": False}
+
+
+def enable(output: str = None) -> None:
+    """
+    Enables profiling and registers the trace export for when the process exits.
+    """
+    if _STATE["enabled"]:
+        return
+    _STATE["enabled"] = True
+    _STATE["output"] = output or getenv("DATARIO_PROFILE_OUTPUT")
+    # Everything from the first datario_cli import until now is import time
+    record("imports", "imports", _ORIGIN, perf_counter())
+    atexit.register(finish)
+
+
+def is_requested() -> bool:
+    """
+    Asserts that profiling is requested through `DATARIO_PROFILE`, read as a boolean (`1`, `true`,
+    `yes` or `on`).
+    """
+    return (getenv("DATARIO_PROFILE") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def is_enabled() -> bool:
+    """
+    Asserts that profiling is enabled.
+    """
+    return _STATE["enabled"]
+
+
+def record(name: str, category: str, start: float, end: float, **args) -> None:
+    """
+    Records a finished span, with start and end given by `time.perf_counter`.
+    """
+    with _SPANS_LOCK:
+        _SPANS.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - _ORIGIN) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": getpid(),
+            "tid": get_ident(),
+            "args": args,
+        })
+
+
+@contextmanager
+def span(name: str, category: str = "general", **args):
+    """
+    Context manager that records a timed span around its block, if profiling is enabled.
+    """
+    if not _STATE["enabled"]:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(name, category, start, perf_counter(), **args)
+
+
+def timed(category: str = "general", name: str = None) -> Callable:
+    """
+    Decorator that records a timed span for each call of the decorated function.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_chrome_trace(path: str) -> None:
+    """
+    Exports the recorded spans to the given path in the Chrome trace-event JSON format.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with _SPANS_LOCK:
+        events = list(_SPANS)
+    with open(path, "w") as trace_file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+
+def summarize() -> List[Dict]:
+    """
+    Aggregates the recorded spans per name, sorted by total time spent.
+    """
+    summary = {}
+    with _SPANS_LOCK:
+        for event in _SPANS:
+            entry = summary.setdefault(event["name"], {
+                "name": event["name"],
+                "category": event["cat"],
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+            })
+            entry["count"] += 1
+            entry["total"] += event["dur"] / 1e6
+            entry["max"] = max(entry["max"], event["dur"] / 1e6)
+    return sorted(summary.values(), key=lambda entry: entry["total"], reverse=True)
+
+
+def print_summary(file=sys.stderr) -> None:
+    """
+    Prints a table with the time spent on each step.
+    """
+    rows = summarize()
+    if not rows:
+        return
+    width = min(max(len(row["name"]) for row in rows), 80)
+    print(f"\n{'step':<{width}}  {'category':<10} {'count':>5} {'total (s)':>10} {'max (s)':>9}",
+          file=file)
+    for row in rows:
+        name = row["name"] if len(row["name"]) <= width else row["name"][:width - 3] + "..."
+        print(f"{name:<{width}}  {row['category']:<10} {row['count']:>5}"
+              f" {row['total']:>10.3f} {row['max']:>9.3f}", file=file)
+
+
+def finish() -> None:
+    """
+    Exports the trace and prints the summary. Registered to run at exit by `enable`. With JSON
+    logs, the summary is skipped and the trace path is logged, so that stderr stays JSON lines.
+    """
+    from datario_cli.constants import Constants as constants
+    from datario_cli.logger import get_format, log
+    output = _STATE.get("output") or str(
+        constants.DATARIO_TRACES_DIRECTORY.value /
+        f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    export_chrome_trace(output)
+    if get_format() == "json":
+        log(f"Trace saved to {output}")
+        return
+    print_summary()
+    print(f"\nTrace saved to {output}", file=sys.stderr)
@@ -0,0 +1,233 @@
+"""
+Declarative batch runbooks, executed as a parallel DAG of datario commands.
+
+A runbook is a YAML file such as:
+
+    environments_file: ~/.datario/envs-staging.json  # optional
+    iac_ref: v1.2.0  # optional
+    max_workers: 4  # optional
+    steps:
+      - name: cluster
+        command: gke apply
+      - name: build
+        command: prefect build
+      - name: agent
+        command: prefect apply
+        context: gke_my-project_us-central1_cluster
+        depends_on: [cluster, build]
+
+Each step may target its own kube context. The environments file (the configuration profile) and
+the iac-public revision are set through environment variables shared by all steps, which run in
+the same process, so they apply to the whole runbook: use one runbook per profile.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+import hashlib
+import inspect
+import json
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from typer.models import OptionInfo
+import yaml
+
+from datario_cli.constants import Constants as constants, expand_path
+from datario_cli.logger import log
+from datario_cli.profiling import span
+from datario_cli.sub import config, gke, prefect
+from datario_cli.utils import build_directory_tree, random_emoji, setenv
+
+STEP_COMMANDS = {
+    "config doctor": (config.setup, config.doctor),
+    "config show": (config.setup, config.show),
+    "gke apply": (gke.setup, gke.apply),
+    "gke plan": (gke.setup, gke.plan),
+    "gke status": (gke.setup, gke.status),
+    "prefect apply": (prefect.setup, prefect.apply),
+    "prefect build": (partial(prefect.setup, check_build=False), prefect.build),
+    "prefect status": (prefect.setup, prefect.status),
+}
+CONTEXT_COMMANDS = ["prefect apply", "prefect status"]
+# Runbook keys that apply to all steps, as they're set on the environment shared by them
+RUNBOOK_WIDE_KEYS = ["environments_file", "iac_ref"]
+
+
+def call_command(func: Callable, **kwargs):
+    """
+    Calls a Typer command function directly, replacing `typer.Option` defaults by their values.
+    """
+    for name, parameter in inspect.signature(func).parameters.items():
+        if name not in kwargs and isinstance(parameter.default, OptionInfo):
+            kwargs[name] = parameter.default.default
+    return func(**kwargs)
+
+
+def load_runbook(path: str) -> Dict:
+    """
+    Loads and validates the runbook at the given path.
+    """
+    with open(path) as runbook_file:
+        runbook = yaml.safe_load(runbook_file) or {}
+    steps = runbook.get("steps") or []
+    if not steps:
+        raise ValueError(f"Runbook {path} has no steps")
+    names = [step.get("name") for step in steps]
+    for step in steps:
+        if not step.get("name"):
+            raise ValueError(f"Step without a name: {step}")
+        if names.count(step["name"]) > 1:
+            raise ValueError(f"Duplicated step name: {step['name']}")
+        if step.get("command") not in STEP_COMMANDS:
+            raise ValueError(
+                f"Invalid command for step {step['name']}: {step.get('command')}."
+                f" Valid commands are: {list(STEP_COMMANDS)}")
+        if step.get("context") and step["command"] not in CONTEXT_COMMANDS:
+            raise ValueError(
+                f"Step {step['name']} sets a context, but {step['command']} doesn't accept one")
+        for key in RUNBOOK_WIDE_KEYS:
+            if key in step:
+                raise ValueError(
+                    f"Step {step['name']} sets {key}, but it applies to the whole runbook."
+                    f" Use one runbook per {key}")
+        step["depends_on"] = step.get("depends_on") or []
+        for dependency in step["depends_on"]:
+            if dependency not in names:
+                raise ValueError(f"Step {step['name']} depends on unknown step {dependency}")
+    sort_steps(steps)
+    return runbook
+
+
+def sort_steps(steps: List[Dict]) -> List[Dict]:
+    """
+    Sorts the steps topologically, raising an error if there are dependency cycles.
+    """
+    pending = {step["name"]: step for step in steps}
+    sorted_steps = []
+    while pending:
+        ready = [
+            step for step in pending.values()
+            if all(dependency not in pending for dependency in step["depends_on"])
+        ]
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {list(pending)}")
+        for step in ready:
+            sorted_steps.append(pending.pop(step["name"]))
+    return sorted_steps
+
+
+def step_hash(step: Dict) -> str:
+    """
+    Hashes a step definition, so that resumed runs only skip steps that didn't change.
+    """
+    return hashlib.sha1(json.dumps(step, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def state_path(runbook_path: str) -> Path:
+    """
+    Gets the path of the file that stores the state of the last run of a runbook.
+    """
+    key = hashlib.sha1(expand_path(runbook_path).encode("utf-8")).hexdigest()
+    return constants.DATARIO_RUNS_DIRECTORY.value / f"{key}.json"
+
+
+def load_state(runbook_path: str) -> Dict[str, str]:
+    """
+    Loads the completed steps (name to definition hash) of the last run of a runbook.
+    """
+    path = state_path(runbook_path)
+    if not path.exists():
+        return {}
+    with open(path) as state_file:
+        return json.load(state_file).get("completed", {})
+
+
+def save_state(runbook_path: str, completed: Dict[str, str]) -> None:
+    """
+    Saves the completed steps of a runbook run.
+    """
+    path = state_path(runbook_path)
+    build_directory_tree(path.parent)
+    with open(path, "w") as state_file:
+        json.dump({"runbook": expand_path(runbook_path),
+                  "completed": completed}, state_file, indent=4)
+
+
+def run_step(step: Dict) -> None:
+    """
+    Runs a single step of a runbook.
+    """
+    _, command = STEP_COMMANDS[step["command"]]
+    kwargs = {}
+    if step["command"] in CONTEXT_COMMANDS:
+        kwargs["context"] = step.get("context")
+    log(f'{random_emoji("technology")} [{step["name"]}] Iniciando `{step["command"]}`...')
+    try:
+        with span(step["name"], "step", command=step["command"]):
+            call_command(command, **kwargs)
+    except SystemExit as exc:
+        if exc.code:
+            raise RuntimeError(f"exit code {exc.code}") from exc
+    log(f'{random_emoji("success")} [{step["name"]}] Concluído.', "success")
+
+
+def run_runbook(path: str, resume: bool = False, max_workers: int = None) -> bool:
+    """
+    Runs the runbook at the given path. Independent steps run in parallel and shared setup runs
+    once, before any step. When resuming, steps that succeeded on the last run are skipped.
+    Returns whether all steps succeeded.
+    """
+    runbook = load_runbook(path)
+    steps = sort_steps(runbook["steps"])
+    if runbook.get("environments_file"):
+        setenv("DATARIO_ENVIRONMENTS_FILE", expand_path(runbook["environments_file"]))
+    if runbook.get("iac_ref"):
+        setenv("DATARIO_IAC_REF", str(runbook["iac_ref"]))
+
+    completed = {}
+    if resume:
+        previous = load_state(path)
+        completed = {
+            step["name"]: step_hash(step) for step in steps
+            if previous.get(step["name"]) == step_hash(step)
+        }
+        if completed:
+            log(f'{random_emoji("nerd")} Retomando execução, pulando: {list(completed)}')
+    pending = {step["name"]: step for step in steps if step["name"] not in completed}
+    if not pending:
+        log(f'{random_emoji("success")} Todos os passos já foram concluídos!', "success")
+        return True
+
+    # Shared setup runs serially, as it may prompt for missing configurations
+    for step in pending.values():
+        setup, _ = STEP_COMMANDS[step["command"]]
+        setup()
+
+    failed = []
+    running = {}
+    max_workers = max_workers or runbook.get("max_workers") or len(pending)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if not failed:
+                for name, step in list(pending.items()):
+                    if all(dependency in completed for dependency in step["depends_on"]):
+                        running[executor.submit(run_step, step)] = pending.pop(name)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    future.result()
+                    completed[step["name"]] = step_hash(step)
+                except Exception as exc:
+                    log(f'{random_emoji("error")} [{step["name"]}] Falhou: {exc}', "error")
+                    failed.append(step["name"])
+            save_state(path, completed)
+
+    if failed:
+        log(f'{random_emoji("error")} Passos com falha: {failed}. Passos não executados: '
+            f'{list(pending)}. Use `--resume` para continuar do primeiro passo com falha.', "error")
+        return False
+    log(f'{random_emoji("success")} Runbook executado com sucesso!', "success")
+    return True
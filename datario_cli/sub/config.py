@@ -5,13 +5,15 @@ Configuration management through environment variables.
 from os import getenv
 from pathlib import Path
 
-from typer import Typer
+from typer import Exit, Typer
 
 from datario_cli.constants import Constants as constants
+from datario_cli.doctor import run_checks
 from datario_cli.logger import log
 from datario_cli.utils import (
     check_for_env_vars,
     get_confirmation,
+    get_environments_file,
     load_env_file,
     prompt_env,
     random_emoji,
@@ -37,10 +39,10 @@ def init():
     """
     setup()
 
-    if Path(constants.DATARIO_ENVIRONMENTS_FILE.value).exists():
+    if Path(get_environments_file()).exists():
         print("🤔 Você já tem um arquivo de configuração.")
         if get_confirmation("apagar o arquivo"):
-            Path(constants.DATARIO_ENVIRONMENTS_FILE.value).unlink()
+            Path(get_environments_file()).unlink()
             print("🗑️ Arquivo apagado.")
             for key in constants.DATARIO_ENVIRONMENTS_LIST.value:
                 setenv(key, "")
@@ -55,7 +57,7 @@ def init():
     )
 
     # Save environment variables
-    save_env_file(constants.DATARIO_ENVIRONMENTS_FILE.value)
+    save_env_file(get_environments_file())
 
     # Emit success message
     log(f'{random_emoji("success")} Configurações iniciadas.')
@@ -69,8 +71,8 @@ def reset():
     setup()
     accept = get_confirmation("deletar suas configurações atuais?")
     if accept:
-        if Path(constants.DATARIO_ENVIRONMENTS_FILE.value).exists():
-            Path(constants.DATARIO_ENVIRONMENTS_FILE.value).unlink()
+        if Path(get_environments_file()).exists():
+            Path(get_environments_file()).unlink()
             log(f'{random_emoji("success")} Arquivo de configurações apagado com sucesso!',
                 "success")
         else:
@@ -95,6 +97,26 @@ def show():
             log(f'  * {value["prompt_text"]}: <not set>', level="warning")
 
 
+@app.command()
+def doctor():
+    """
+    Validate configurations set
+    """
+    setup()
+    log(f'{random_emoji("nerd")} Verificando configurações...')
+    results = run_checks(list(constants.DATARIO_ENVIRONMENTS_LIST.value))
+    for key, value in constants.DATARIO_ENVIRONMENTS_LIST.value.items():
+        if not results[key]:
+            log(f'  * {value["prompt_text"]}: OK')
+        for level, problem in results[key]:
+            log(f'  * {value["prompt_text"]}: {problem}', level=level)
+    if any(level == "error" for problems in results.values() for level, _ in problems):
+        log(f'{random_emoji("error")} Há configurações inválidas.'
+            " Você pode corrigi-las com o comando `datario config update`.")
+        raise Exit(1)
+    log(f'{random_emoji("success")} Configurações válidas!')
+
+
 @app.command()
 def update():
     """
@@ -109,8 +131,10 @@ def update():
                 default=env_value,
                 callback_function=constants.DATARIO_ENVIRONMENTS_LIST.value[
                     env_name]["callback_function"],
+                completion_suffix=constants.DATARIO_ENVIRONMENTS_LIST.value[
+                    env_name].get("completion_suffix"),
             )
             setenv(env_name, env_value)
     # Save environment variables
-    save_env_file(constants.DATARIO_ENVIRONMENTS_FILE.value)
+    save_env_file(get_environments_file())
     log(f'{random_emoji("success")} Configurações salvas.')
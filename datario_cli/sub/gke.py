@@ -4,11 +4,27 @@ GKE cluster management through Terraform
 
 from functools import partial
 from sys import argv
+from time import perf_counter
+from typing import List
 
-from typer import Typer
+from typer import Option, Typer
 
-from datario_cli.constants import Constants as constants
+from datario_cli import cassette
+from datario_cli.doctor import check_configuration
+from datario_cli.history import record_duration, tracked_step
+from datario_cli.iac import get_iac_directory, update_iac_repository
 from datario_cli.logger import log
+from datario_cli.profiling import timed
+from datario_cli.terraform import (
+    TUNING_STEP,
+    build_arguments,
+    configure_plugin_cache,
+    get_step_name,
+    get_tuning_step_name,
+    mark_used_providers,
+    prune_plugin_cache,
+    tune_parallelism,
+)
 from datario_cli.utils import (
     append_output_to_string,
     check_for_env_vars,
@@ -17,15 +33,27 @@ from datario_cli.utils import (
     get_confirmation,
     random_emoji,
     random_emoji,
-    update_git_repo,
+    run_once,
 )
 
 app = Typer()
 
+TARGET_OPTION = Option(
+    None,
+    help="Resource or module address to target (can be given multiple times)",
+)
+PARALLELISM_OPTION = Option(
+    None,
+    help="Number of concurrent terraform operations (tuned from past runs by default)",
+)
+
 
-def setup():
+@run_once
+@timed("setup")
+def setup_environment():
     """
-    Setup before running commands.
+    Checks requirements, environment variables and the IaC repository, then initializes
+    terraform. Runs only once per process, so that batch runs share it.
     """
     check_requirements([
         "git",
@@ -38,22 +66,91 @@ def setup():
             "TF_VAR_project_id",
         ]
     )
-    update_git_repo()
-    echo_and_run(
-        f"cd {constants.IAC_DIRECTORY.value}/gke && terraform init && terraform refresh",
-        stdout_callback=lambda _: None,
-    )
+    check_configuration([
+        "GOOGLE_APPLICATION_CREDENTIALS",
+        "TF_VAR_bucket_name",
+        "TF_VAR_project_id",
+    ])
+    update_iac_repository()
+    configure_plugin_cache()
+    with tracked_step("gke init"):
+        echo_and_run(
+            f"cd {get_iac_directory()}/gke && terraform init",
+            stdout_callback=lambda _: None,
+        )
+    prune_plugin_cache(
+        keep=mark_used_providers(get_iac_directory() / "gke" / ".terraform.lock.hcl"))
+
+
+@run_once
+@timed("setup")
+def refresh_state():
+    """
+    Refreshes the terraform state of the whole stack. Runs only once per process.
+    """
+    with tracked_step("gke refresh"):
+        echo_and_run(
+            f"cd {get_iac_directory()}/gke && terraform refresh",
+            stdout_callback=lambda _: None,
+        )
+
+
+def setup(refresh: bool = True):
+    """
+    Setup before running commands.
+    """
+    setup_environment()
+    if refresh:
+        refresh_state()
+
+
+def run_terraform(
+    step: str,
+    command: str,
+    targets: List[str] = None,
+    parallelism: int = None,
+    refresh: bool = True,
+    **kwargs,
+) -> int:
+    """
+    Runs a terraform command on the GKE stack, tuning its parallelism if none is given. Its
+    duration is recorded under the given step name. Full-stack plans also record it, or their
+    failure, for tuning, and are the only runs that try new parallelism values. Parallelism isn't
+    tuned when recording or replaying a cassette, as commands must match their recorded text.
+    """
+    tune = not parallelism and not cassette.get_mode()
+    tuning = tune and step == TUNING_STEP and not targets and refresh
+    if tune:
+        parallelism = tune_parallelism(explore=tuning)
+    start = perf_counter()
+    return_code = None
+    try:
+        with tracked_step(get_step_name(step, targets, refresh)):
+            return_code = echo_and_run(
+                f"cd {get_iac_directory()}/gke && terraform {command}"
+                f"{build_arguments(targets, parallelism, refresh)}",
+                **kwargs,
+            )
+    except SystemExit as exc:
+        return_code = exc.code
+        raise
+    finally:
+        if tuning and return_code is not None:
+            record_duration(get_tuning_step_name(parallelism, failed=bool(return_code)),
+                            perf_counter() - start)
+    return return_code
 
 
 @app.command()
-def apply():
+def apply(
+    target: List[str] = TARGET_OPTION,
+    parallelism: int = PARALLELISM_OPTION,
+):
     """
     Applies the changes to the GKE cluster.
     """
-    setup()
-    echo_and_run(
-        f"cd {constants.IAC_DIRECTORY.value}/gke && terraform apply -auto-approve",
-    )
+    setup(refresh=not target)
+    run_terraform("gke apply", "apply -auto-approve", targets=target, parallelism=parallelism)
 
 
 @app.command()
@@ -63,33 +160,40 @@ def destroy():
     """
     if get_confirmation("destruir o cluster GKE"):
         setup()
-        echo_and_run(
-            f"cd {constants.IAC_DIRECTORY.value}/gke && terraform destroy -auto-approve",
-        )
+        run_terraform("gke destroy", "destroy -auto-approve")
         log(f'{random_emoji("success")} O cluster GKE foi destruído.', "success")
 
 
 @app.command()
-def plan():
+def plan(
+    target: List[str] = TARGET_OPTION,
+    parallelism: int = PARALLELISM_OPTION,
+    refresh: bool = Option(
+        True, help="Use --no-refresh for a fast plan, when the state is known to be fresh"),
+):
     """
     Plans the changes to the GKE cluster.
     """
-    setup()
-    echo_and_run(
-        f"cd {constants.IAC_DIRECTORY.value}/gke && terraform plan",
-    )
+    setup(refresh=refresh and not target)
+    run_terraform("gke plan", "plan", targets=target, parallelism=parallelism, refresh=refresh)
 
 
 @app.command()
-def status():
+def status(
+    target: List[str] = TARGET_OPTION,
+    parallelism: int = PARALLELISM_OPTION,
+):
     """
     Prints the status of the GKE cluster.
     """
-    setup()
+    setup(refresh=not target)
     log(f'{random_emoji("technology")} Verificando o status do cluster GKE...')
     output_str = [""]
-    echo_and_run(
-        f"cd {constants.IAC_DIRECTORY.value}/gke && terraform plan -refresh-only",
+    run_terraform(
+        "gke status",
+        "plan -refresh-only",
+        targets=target,
+        parallelism=parallelism,
         stdout_callback=partial(append_output_to_string,
                                 wrapped_string=output_str)
     )
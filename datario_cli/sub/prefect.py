@@ -3,14 +3,22 @@ Prefect Agent management through Helm and kubectl
 """
 
 import base64
+import json
 from os import getenv
+from typing import Dict
 
-import requests
-from typer import Typer
+from typer import Option, Typer
 import yaml
 
+from datario_cli import cassette
+from datario_cli.completion import complete_kube_contexts
 from datario_cli.constants import Constants as constants
+from datario_cli.doctor import check_configuration
+from datario_cli.drift import delete_snapshot, diff_snapshot, save_snapshot
+from datario_cli.history import tracked_step
+from datario_cli.iac import get_iac_directory, get_iac_path, update_iac_repository
 from datario_cli.logger import log
+from datario_cli.profiling import timed
 from datario_cli.utils import (
     check_for_env_vars,
     check_requirements,
@@ -18,14 +26,22 @@ from datario_cli.utils import (
     file_exists,
     get_confirmation,
     get_current_kubectl_context,
+    http_get,
     load_env_file,
     random_emoji,
     random_emoji,
-    update_git_repo,
+    run_once,
 )
+from datario_cli.vault import is_reference, resolve_references
 
 app = Typer()
 
+CONTEXT_OPTION = Option(
+    None,
+    help="kubectl context to use (defaults to the current context)",
+    autocompletion=complete_kube_contexts,
+)
+
 
 def to_single_base64(text: str) -> str:
     """
@@ -43,20 +59,48 @@ def to_double_base64(text: str) -> str:
     return second_step
 
 
-def build_secrets_yaml():
+def read_credentials(value: str, from_vault: bool = False) -> str:
     """
-    Builds the secrets.yaml file.
+    Reads a credentials file, unless the value was resolved from Vault, in which case it's already
+    the file contents.
     """
-    # Get inputs
+    if from_vault:
+        return value
+    with open(value) as credentials_file:
+        return credentials_file.read()
+
+
+@timed("build")
+def render_secrets() -> Dict[str, dict]:
+    """
+    Renders the secrets manifests, indexed by name.
+    """
+    # Get inputs, resolving the ones that point to Vault
+    values = {
+        name: getenv(name) for name in [
+            "BASEDOSDADOS_CREDENTIALS_PROD_PATH",
+            "BASEDOSDADOS_CREDENTIALS_STAGING_PATH",
+            "PREFECT_TOKEN",
+            "PREFECT_TENANT_ID",
+        ]
+    }
+    from_vault = {name for name, value in values.items() if is_reference(value)}
+    inputs = resolve_references(values)
     project_name: str = getenv("TF_VAR_project_id")
-    bd_prod_sa_path: str = getenv("BASEDOSDADOS_CREDENTIALS_PROD_PATH")
-    bd_staging_sa_path: str = getenv("BASEDOSDADOS_CREDENTIALS_STAGING_PATH")
     vault_token: str = getenv("VAULT_TOKEN")
-    prefect_api_key: str = getenv("PREFECT_TOKEN")
-    prefect_tenant_id: str = getenv("PREFECT_TENANT_ID")
+    prefect_api_key: str = inputs["PREFECT_TOKEN"]
+    prefect_tenant_id: str = inputs["PREFECT_TENANT_ID"]
+    bd_prod_sa: str = read_credentials(
+        inputs["BASEDOSDADOS_CREDENTIALS_PROD_PATH"],
+        "BASEDOSDADOS_CREDENTIALS_PROD_PATH" in from_vault,
+    )
+    bd_staging_sa: str = read_credentials(
+        inputs["BASEDOSDADOS_CREDENTIALS_STAGING_PATH"],
+        "BASEDOSDADOS_CREDENTIALS_STAGING_PATH" in from_vault,
+    )
 
     # Open and split secrets documents
-    with open(constants.IAC_PREFECT_SECRETS_BASE_PATH.value) as secrets_base_file:
+    with open(get_iac_path(constants.IAC_PREFECT_SECRETS_BASE_PATH)) as secrets_base_file:
         txt = secrets_base_file.read()
     documents = txt.split("---")
     yamls = [yaml.safe_load(document) for document in documents]
@@ -65,18 +109,13 @@ def build_secrets_yaml():
 
     # Update values on secrets
     # GCP SA
-    # Open up the prod credentials file
-    with open(bd_prod_sa_path) as bd_prod_sa_file:
-        txt = bd_prod_sa_file.read()
-    yamls_dict["gcp-sa"]["data"]["creds.json"] = to_single_base64(txt)
+    yamls_dict["gcp-sa"]["data"]["creds.json"] = to_single_base64(bd_prod_sa)
     # DBT credentials
-    with open(bd_prod_sa_path) as bd_prod_sa_file:
-        txt = bd_prod_sa_file.read()
-    yamls_dict["credentials-dev"]["data"]["dev.json"] = to_single_base64(txt)
-    yamls_dict["credentials-prod"]["data"]["prod.json"] = to_single_base64(txt)
+    yamls_dict["credentials-dev"]["data"]["dev.json"] = to_single_base64(bd_prod_sa)
+    yamls_dict["credentials-prod"]["data"]["prod.json"] = to_single_base64(bd_prod_sa)
     # Prefect
     # Open up the auth.toml file
-    with open(constants.IAC_PREFECT_AUTH_TOML_PATH.value) as auth_toml_file:
+    with open(get_iac_path(constants.IAC_PREFECT_AUTH_TOML_PATH)) as auth_toml_file:
         txt = auth_toml_file.read()
     txt = txt.replace("prefect-api-key", prefect_api_key)
     txt = txt.replace("prefect-tenant-id", prefect_tenant_id)
@@ -84,21 +123,17 @@ def build_secrets_yaml():
         txt)
     # Basedosdados
     # First the basedosdados config.toml
-    with open(constants.IAC_PREFECT_BD_CONFIG_BASE_PATH.value) as bd_config_base_file:
+    with open(get_iac_path(constants.IAC_PREFECT_BD_CONFIG_BASE_PATH)) as bd_config_base_file:
         txt = bd_config_base_file.read()
     txt = txt.replace("your-project-name", project_name)
     yamls_dict["gcp-credentials"]["data"]["BASEDOSDADOS_CONFIG"] = to_double_base64(
         txt)
     # Basedosdados prod service account
-    with open(bd_prod_sa_path) as bd_prod_sa_file:
-        txt = bd_prod_sa_file.read()
     yamls_dict["gcp-credentials"]["data"]["BASEDOSDADOS_CREDENTIALS_PROD"] = to_double_base64(
-        txt)
+        bd_prod_sa)
     # Basedosdados staging service account
-    with open(bd_staging_sa_path) as bd_staging_sa_file:
-        txt = bd_staging_sa_file.read()
     yamls_dict["gcp-credentials"]["data"]["BASEDOSDADOS_CREDENTIALS_STAGING"] = to_double_base64(
-        txt)
+        bd_staging_sa)
     # Vault
     # Now the Vault address
     yamls_dict["vault-credentials"]["data"]["VAULT_ADDRESS"] = to_single_base64(
@@ -107,20 +142,31 @@ def build_secrets_yaml():
     yamls_dict["vault-credentials"]["data"]["VAULT_TOKEN"] = to_single_base64(
         vault_token)
 
+    return yamls_dict
+
+
+@timed("build")
+def build_secrets_yaml():
+    """
+    Builds the secrets.yaml file.
+    """
+    yamls_dict = render_secrets()
+
     # Dump secrets.yaml
-    with open(constants.IAC_PREFECT_SECRETS_PATH.value, "w") as secrets_file:
+    with open(get_iac_path(constants.IAC_PREFECT_SECRETS_PATH), "w") as secrets_file:
         yaml.safe_dump_all(yamls_dict.values(), secrets_file)
 
 
-def build_values_yaml():
+@timed("build")
+def render_values() -> dict:
     """
-    Builds the values.yaml file.
+    Renders the Helm values.
     """
     # Get inputs
     project_name: str = getenv("TF_VAR_project_id")
 
     # Open base file
-    with open(constants.IAC_PREFECT_VALUES_BASE_PATH.value) as values_base_file:
+    with open(get_iac_path(constants.IAC_PREFECT_VALUES_BASE_PATH)) as values_base_file:
         values = yaml.safe_load(values_base_file)
 
     # Add labels to the Prefect Agent
@@ -129,8 +175,18 @@ def build_values_yaml():
     # Modify the Apollo URL
     values["agent"]["apollo_url"] = "https://prefect.dados.rio/api/"
 
+    return values
+
+
+@timed("build")
+def build_values_yaml():
+    """
+    Builds the values.yaml file.
+    """
+    values = render_values()
+
     # Dump values.yaml
-    with open(constants.IAC_PREFECT_VALUES_PATH.value, "w") as values_file:
+    with open(get_iac_path(constants.IAC_PREFECT_VALUES_PATH), "w") as values_file:
         yaml.safe_dump(values, values_file)
 
 
@@ -140,15 +196,11 @@ def accept_existing_helm_repo(status_code):
     raise Exception("Error while adding the helm repo")
 
 
-def setup(check_build: bool = True):
+@run_once
+def check_environment():
     """
-    Setup before running commands.
+    Checks environment variables and configurations. Runs only once per process.
     """
-    check_requirements([
-        "git",
-        "helm",
-        "kubectl",
-    ])
     check_for_env_vars([
         "BASEDOSDADOS_CREDENTIALS_PROD_PATH",
         "BASEDOSDADOS_CREDENTIALS_STAGING_PATH",
@@ -156,23 +208,95 @@ def setup(check_build: bool = True):
         "VAULT_TOKEN",
     ])
     load_env_file()
-    update_git_repo()
+    check_configuration([
+        "BASEDOSDADOS_CREDENTIALS_PROD_PATH",
+        "BASEDOSDADOS_CREDENTIALS_STAGING_PATH",
+        "TF_VAR_project_id",
+        "VAULT_TOKEN",
+        "PREFECT_TOKEN",
+        "PREFECT_TENANT_ID",
+    ])
+
+
+@run_once
+@timed("setup")
+def setup_environment():
+    """
+    Checks requirements, environment variables, the IaC repository and the Helm repository. Runs
+    only once per process, so that batch runs share it.
+    """
+    check_requirements([
+        "git",
+        "helm",
+        "kubectl",
+    ])
+    check_environment()
+    update_iac_repository()
+    echo_and_run(
+        "helm repo add prefeitura-rio https://helm.dados.rio", on_error=accept_existing_helm_repo)
+    echo_and_run("helm repo update")
+
+
+def get_chart_version() -> str:
+    """
+    Gets the version of the Prefect Agent chart on the local Helm repository cache.
+    """
+    output = []
+    return_code = echo_and_run(
+        "helm search repo prefeitura-rio/prefect-agent --output json",
+        stdout_callback=output.append,
+        on_error="return",
+    )
+    if return_code:
+        return None
+    charts = json.loads("".join(output) or "[]")
+    return charts[0]["version"] if charts else None
+
+
+def load_applied_manifests() -> Dict:
+    """
+    Loads the built secrets and values files, as they are applied to the cluster.
+    """
+    with open(get_iac_path(constants.IAC_PREFECT_SECRETS_PATH)) as secrets_file:
+        secrets = {
+            document["metadata"]["name"]: document
+            for document in yaml.safe_load_all(secrets_file) if document
+        }
+    with open(get_iac_path(constants.IAC_PREFECT_VALUES_PATH)) as values_file:
+        values = yaml.safe_load(values_file)
+    return {"secrets": secrets, "values": values}
+
+
+@timed("setup")
+def setup_local():
+    """
+    Setup for checks that run locally only: configurations and an IaC checkout, which is only
+    cloned if missing. Neither the IaC nor the Helm repositories are updated, except when recording
+    or replaying a cassette, so that the checkout files are captured and restored.
+    """
+    check_environment()
+    if cassette.get_mode() or not get_iac_directory().exists():
+        update_iac_repository()
+
+
+def setup(check_build: bool = True):
+    """
+    Setup before running commands.
+    """
+    setup_environment()
     if check_build:
-        if not file_exists(constants.IAC_PREFECT_SECRETS_PATH.value):
+        if not file_exists(get_iac_path(constants.IAC_PREFECT_SECRETS_PATH)):
             log(f'{random_emoji("error")} Agent secrets file not found. Building...', "warning")
             build_secrets_yaml()
             log(f'{random_emoji("success")} Agent secrets file built.', "success")
-        if not file_exists(constants.IAC_PREFECT_VALUES_PATH.value):
+        if not file_exists(get_iac_path(constants.IAC_PREFECT_VALUES_PATH)):
             log(f'{random_emoji("error")} Agent values file not found. Building...', "warning")
             build_values_yaml()
             log(f'{random_emoji("success")} Agent values file built.', "success")
-    echo_and_run(
-        "helm repo add prefeitura-rio https://helm.dados.rio", on_error=accept_existing_helm_repo)
-    echo_and_run("helm repo update")
 
 
 @app.command()
-def apply(context: str = None):
+def apply(context: str = CONTEXT_OPTION):
     """
     Applies Prefect Agent manifests
     """
@@ -182,23 +306,26 @@ def apply(context: str = None):
     log(f'{random_emoji("technology")} Aplicando os manifestos do Kubernetes...')
     log(f'{random_emoji("technology")} Criando namespace...')
     echo_and_run(
-        f"kubectl apply -f {constants.IAC_PREFECT_NAMESPACE_PATH.value}"
+        f"kubectl apply -f {get_iac_path(constants.IAC_PREFECT_NAMESPACE_PATH)}"
         f" --context {context}"
     )
     log(f'{random_emoji("technology")} Criando secrets...')
     echo_and_run(
-        f"kubectl apply -f {constants.IAC_PREFECT_SECRETS_PATH.value}"
+        f"kubectl apply -f {get_iac_path(constants.IAC_PREFECT_SECRETS_PATH)}"
         f" --context {context}"
         " --namespace prefect"
     )
     log(f'{random_emoji("technology")} Instalando o Helm chart...')
-    echo_and_run(
-        "helm upgrade --install prefect-agent"
-        " prefeitura-rio/prefect-agent"
-        " --namespace prefect"
-        f" --kube-context {context}"
-        f" -f {constants.IAC_PREFECT_VALUES_PATH.value}"
-    )
+    chart_version = get_chart_version()
+    with tracked_step("helm upgrade", context):
+        echo_and_run(
+            "helm upgrade --install prefect-agent"
+            " prefeitura-rio/prefect-agent"
+            " --namespace prefect"
+            f" --kube-context {context}"
+            f" -f {get_iac_path(constants.IAC_PREFECT_VALUES_PATH)}"
+        )
+    save_snapshot(context, chart_version=chart_version, **load_applied_manifests())
     log(f'{random_emoji("success")} O deployment do Prefect Agent foi um sucesso!', "success")
 
 
@@ -217,7 +344,7 @@ def build():
 
 
 @app.command()
-def destroy(context: str = None):
+def destroy(context: str = CONTEXT_OPTION):
     """
     Tears down Prefect Agent manifests
     """
@@ -226,27 +353,33 @@ def destroy(context: str = None):
         if context is None:
             context = get_current_kubectl_context()
         log(f'{random_emoji("technology")} Removendo o Helm chart...')
-        echo_and_run(
-            "helm uninstall prefect-agent -n prefect"
-            f" --kube-context {context}"
-        )
+        with tracked_step("helm uninstall", context):
+            echo_and_run(
+                "helm uninstall prefect-agent -n prefect"
+                f" --kube-context {context}"
+            )
         log(f'{random_emoji("technology")} Removendo os manifestos do Kubernetes...')
         log(f'{random_emoji("technology")} Removendo os secrets...')
         echo_and_run(
-            f"kubectl delete -f {constants.IAC_PREFECT_SECRETS_PATH.value}"
+            f"kubectl delete -f {get_iac_path(constants.IAC_PREFECT_SECRETS_PATH)}"
             f" --context {context}"
             " --namespace prefect"
         )
         log(f'{random_emoji("technology")} Removendo o namespace...')
         echo_and_run(
-            f"kubectl delete -f {constants.IAC_PREFECT_NAMESPACE_PATH.value}"
+            f"kubectl delete -f {get_iac_path(constants.IAC_PREFECT_NAMESPACE_PATH)}"
             f" --context {context}"
         )
+        delete_snapshot(context)
         log(f'{random_emoji("success")} O Prefect Agent foi removido com sucesso!', "success")
 
 
 @app.command()
-def status(context: str = None):
+def status(
+    context: str = CONTEXT_OPTION,
+    remote: bool = Option(
+        False, help="Always compares with the cluster, even if nothing changed locally"),
+):
     """
     Checks Prefect Agent status
     """
@@ -256,44 +389,78 @@ def status(context: str = None):
         nonlocal value
         value += output.strip()
 
-    setup()
+    # The secrets can't be rendered without these, so only the cluster is checked
+    check_environment()
+    missing = [name for name in ["PREFECT_TOKEN", "PREFECT_TENANT_ID"] if not getenv(name)]
+
+    # The local check doesn't need the network: the cluster is only reached if it finds changes
+    if remote:
+        setup(check_build=not missing)
+    else:
+        setup_local()
     if context is None:
         context = get_current_kubectl_context()
 
-    prefect_api_key = getenv("PREFECT_TOKEN")
+    prefect_api_key = resolve_references(
+        {"PREFECT_TOKEN": getenv("PREFECT_TOKEN")})["PREFECT_TOKEN"]
 
-    log(f'{random_emoji("technology")} Verificando o status dos manifestos...')
-    return_code = echo_and_run(
-        f"kubectl diff -f {constants.IAC_PREFECT_SECRETS_PATH.value}"
-        f" --context {context}"
-        " --namespace prefect",
-        stdout_callback=callback,
-        on_error="return",
-    )
-    if value == "" and return_code == 0:
-        log(f'{random_emoji("success")} Os manifestos do Prefect Agent estão OK!', "success")
-    else:
-        log(f'{random_emoji("error")} Os manifestos do Prefect Agent diferem do esperado!',
-            "error")
-
-    log(f'{random_emoji("technology")} Verificando o status do Helm chart...')
-    return_code = echo_and_run(
-        "helm status prefect-agent"
-        f" --kube-context {context}"
-        " --namespace prefect",
-        stdout_callback=callback,
-        on_error="return",
-    )
-    if "STATUS: deployed" in value and return_code == 0:
-        log(f'{random_emoji("success")} O Helm chart do Prefect Agent está OK!', "success")
+    if missing:
+        log(f'{random_emoji("error")} Não é possível comparar com o último apply sem'
+            f' {", ".join(missing)}.', "warning")
+        changes = None
     else:
-        log(f'{random_emoji("error")} O Helm chart do Prefect Agent está diferente do esperado!',
-            "error")
+        log(f'{random_emoji("technology")} Comparando com o último apply neste contexto...')
+        changes = diff_snapshot(
+            context,
+            secrets=render_secrets(),
+            values=render_values(),
+            chart_version=get_chart_version(),
+        )
+        if changes is None:
+            log(f'{random_emoji("error")} Não há registro de apply neste contexto.', "warning")
+        elif changes:
+            log(f'{random_emoji("error")} Houve mudanças desde o último apply:', "warning")
+            for change in changes:
+                log(f"  {change}", "warning")
+        else:
+            log(f'{random_emoji("success")} Nada mudou desde o último apply!', "success")
+
+    if remote or changes != []:
+        setup(check_build=not missing)
+        log(f'{random_emoji("technology")} Verificando o status dos manifestos...')
+        return_code = echo_and_run(
+            f"kubectl diff -f {get_iac_path(constants.IAC_PREFECT_SECRETS_PATH)}"
+            f" --context {context}"
+            " --namespace prefect",
+            stdout_callback=callback,
+            on_error="return",
+        )
+        if value == "" and return_code == 0:
+            log(f'{random_emoji("success")} Os manifestos do Prefect Agent estão OK!', "success")
+        else:
+            log(f'{random_emoji("error")} Os manifestos do Prefect Agent diferem do esperado!',
+                "error")
+
+        log(f'{random_emoji("technology")} Verificando o status do Helm chart...')
+        return_code = echo_and_run(
+            "helm status prefect-agent"
+            f" --kube-context {context}"
+            " --namespace prefect",
+            stdout_callback=callback,
+            on_error="return",
+        )
+        if "STATUS: deployed" in value and return_code == 0:
+            log(f'{random_emoji("success")} O Helm chart do Prefect Agent está OK!', "success")
+        else:
+            log(f'{random_emoji("error")} O Helm chart do Prefect Agent está diferente do'
+                ' esperado!', "error")
 
     log(f'{random_emoji("technology")} Verificando capacidade de conexão com o Prefect Server...')
     value = ""
     try:
-        response = requests.get("https://prefect.dados.rio/api", headers={
+        prefect_api_address = (
+            getenv("DATARIO_PREFECT_API_ADDRESS") or constants.DATARIO_PREFECT_API_ADDRESS.value)
+        response = http_get(prefect_api_address, headers={
             "Authorization": f"Bearer {prefect_api_key}",
         })
         value = response.text
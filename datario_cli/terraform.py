@@ -0,0 +1,171 @@
+"""
+Terraform helpers for datario_cli.
+"""
+
+from os import cpu_count, getenv, utime, walk
+from pathlib import Path
+import re
+import shlex
+import shutil
+from statistics import median
+from typing import List
+
+from datario_cli.constants import Constants as constants
+from datario_cli.history import get_durations
+from datario_cli.logger import log
+from datario_cli.utils import build_directory_tree, random_emoji, setenv
+
+MIN_PARALLELISM = 10
+MAX_PARALLELISM = 64
+MIN_SAMPLES = 3
+# Step whose full-stack runs are used to tune parallelism
+TUNING_STEP = "gke plan"
+
+_LOCK_FILE_PROVIDER = re.compile(r'provider\s+"([^"]+)"\s*\{[^}]*?version\s*=\s*"([^"]+)"', re.S)
+
+
+def configure_plugin_cache() -> None:
+    """
+    Points terraform to the shared provider plugin cache, unless the user already set one.
+    """
+    if getenv("TF_PLUGIN_CACHE_DIR"):
+        return
+    build_directory_tree(constants.TERRAFORM_PLUGIN_CACHE_DIRECTORY.value)
+    setenv("TF_PLUGIN_CACHE_DIR", str(constants.TERRAFORM_PLUGIN_CACHE_DIRECTORY.value))
+
+
+def get_directory_size(directory: Path) -> int:
+    """
+    Gets the total size of the files in a directory, in bytes.
+    """
+    size = 0
+    for root, _, files in walk(directory):
+        for name in files:
+            path = Path(root) / name
+            if not path.is_symlink():
+                size += path.stat().st_size
+    return size
+
+
+def mark_used_providers(lock_file: Path) -> List[Path]:
+    """
+    Touches the cached provider versions listed on a `.terraform.lock.hcl` file, so that they're
+    the last to be evicted. Returns their directories.
+    """
+    if not Path(lock_file).exists():
+        return []
+    used = []
+    cache_directory = constants.TERRAFORM_PLUGIN_CACHE_DIRECTORY.value
+    for source, version in _LOCK_FILE_PROVIDER.findall(Path(lock_file).read_text()):
+        version_directory = cache_directory.joinpath(*source.split("/"), version)
+        if version_directory.exists():
+            utime(version_directory)
+            used.append(version_directory)
+    return used
+
+
+def prune_plugin_cache(keep: List[Path] = None, max_bytes: int = None) -> None:
+    """
+    Evicts the least recently used provider versions from the shared plugin cache until it fits
+    on `max_bytes` (defaults to `DATARIO_TF_PLUGIN_CACHE_MAX_BYTES`). Versions in `keep` are never
+    evicted.
+    """
+    if getenv("TF_PLUGIN_CACHE_DIR") != str(constants.TERRAFORM_PLUGIN_CACHE_DIRECTORY.value):
+        # Caches managed by the user are left alone
+        return
+    max_bytes = max_bytes or int(
+        getenv("DATARIO_TF_PLUGIN_CACHE_MAX_BYTES")
+        or constants.TERRAFORM_PLUGIN_CACHE_MAX_BYTES.value)
+    keep = keep or []
+    # Cache layout is <hostname>/<namespace>/<type>/<version>/<os_arch>
+    versions = [
+        path for path in constants.TERRAFORM_PLUGIN_CACHE_DIRECTORY.value.glob("*/*/*/*")
+        if path.is_dir()
+    ]
+    sizes = {path: get_directory_size(path) for path in versions}
+    total = sum(sizes.values())
+    for path in sorted(versions, key=lambda path: path.stat().st_mtime):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        log(f'{random_emoji("technology")} Removendo provider antigo do cache: {path}')
+        shutil.rmtree(path, ignore_errors=True)
+        total -= sizes[path]
+
+
+def build_arguments(
+    targets: List[str] = None,
+    parallelism: int = None,
+    refresh: bool = True,
+) -> str:
+    """
+    Builds the terraform arguments for the given targets, parallelism and refresh settings.
+    """
+    arguments = [shlex.quote(f"-target={target}") for target in targets or []]
+    if parallelism:
+        arguments.append(f"-parallelism={parallelism}")
+    if not refresh:
+        arguments.append("-refresh=false")
+    return "".join(f" {argument}" for argument in arguments)
+
+
+def get_parallelism_candidates() -> List[int]:
+    """
+    Gets the parallelism values worth trying on this machine. Terraform mostly waits on API
+    calls, so a few operations per core are fine.
+    """
+    cores = cpu_count() or 1
+    return sorted({
+        MIN_PARALLELISM,
+        min(max(MIN_PARALLELISM, cores * 4), MAX_PARALLELISM),
+        min(max(MIN_PARALLELISM, cores * 8), MAX_PARALLELISM),
+    })
+
+
+def get_step_name(step: str, targets: List[str] = None, refresh: bool = True) -> str:
+    """
+    Gets the name a terraform run is recorded with on the durations history. Parallelism isn't
+    part of it, so that all runs of a step share their ETA.
+    """
+    name = step
+    if targets:
+        name += f" [{', '.join(sorted(targets))}]"
+    if not refresh:
+        name += " -refresh=false"
+    return name
+
+
+def get_tuning_step_name(parallelism: int, failed: bool = False) -> str:
+    """
+    Gets the name the durations of full-stack plans are recorded with, per parallelism, for tuning.
+    Failed plans are recorded apart.
+    """
+    name = f"{TUNING_STEP} -parallelism={parallelism}"
+    if failed:
+        name += " (failed)"
+    return name
+
+
+def tune_parallelism(explore: bool = False) -> int:
+    """
+    Picks the parallelism for a terraform run from the durations of past full-stack plans, which
+    do comparable amounts of work, unlike applies. When exploring, candidates without enough
+    samples are tried first, starting with the default one for this machine. Otherwise, the
+    sampled candidate with the lowest median duration wins, or the default one if there's none.
+    Candidates that failed (e.g. by hitting API rate limits) are never picked again, except for
+    the default one.
+    """
+    candidates = get_parallelism_candidates()
+    default = candidates[len(candidates) // 2]
+    medians = {}
+    for candidate in [default] + [candidate for candidate in candidates if candidate != default]:
+        if candidate != default and get_durations(get_tuning_step_name(candidate, failed=True)):
+            continue
+        durations = get_durations(get_tuning_step_name(candidate))
+        if len(durations) < MIN_SAMPLES:
+            if explore:
+                return candidate
+            continue
+        medians[candidate] = median(durations)
+    return min(medians, key=medians.get) if medians else default
@@ -3,20 +3,30 @@ General utilities for the datario_cli CLI tool.
 """
 
 import base64
-from functools import partial
-import glob
+import codecs
+import inspect
+from functools import partial, wraps
 import json
-from os import getenv, environ
+from os import getenv, environ, read
 from pathlib import Path
 from random import choice
 import subprocess
 from sys import exit
+from threading import Lock
+from time import perf_counter
 from typing import Callable, List, Union
 
 from typer import prompt, confirm
 
+from datario_cli import cassette
+from datario_cli.completion import load_kube_contexts, path_completer
 from datario_cli.constants import Constants as constants
-from datario_cli.logger import log, logger
+from datario_cli.logger import get_emojis, log, write_output
+from datario_cli.profiling import span
+
+
+_RUN_ONCE_CACHE = {}
+_RUN_ONCE_LOCK = Lock()
 
 
 def append_output_to_string(output: str, wrapped_string: List[str]) -> None:
@@ -26,10 +36,6 @@ def append_output_to_string(output: str, wrapped_string: List[str]) -> None:
     wrapped_string[0] += output
 
 
-def autocomplete_paths(text, state):
-    return (glob.glob(text + "*") + [None])[state]
-
-
 def build_directory_tree(directory: str) -> None:
     """
     Builds the directory tree for the given directory
@@ -39,13 +45,14 @@ def build_directory_tree(directory: str) -> None:
 
 def check_for_env_vars(
     env_vars: List[str],
-    path: str = constants.DATARIO_ENVIRONMENTS_FILE.value,
+    path: str = None,
     save: bool = True,
 ) -> Callable:
     """
     Decorator that checks for required environment variables, and if they are missing, prompts
     values for them using `prompt_env`, sets them and saves to environment files.
     """
+    path = path or get_environments_file()
     load_env_file(path)
     missing_vars = []
     for env_var in env_vars:
@@ -61,7 +68,9 @@ def check_for_env_vars(
                     message=f'[{i+1}/{len(missing_vars)}] '
                     f'{constants.DATARIO_ENVIRONMENTS_LIST.value[env_var]["prompt_text"]}',
                     callback_function=constants.DATARIO_ENVIRONMENTS_LIST.value[
-                        env_var]["callback_function"]
+                        env_var]["callback_function"],
+                    completion_suffix=constants.DATARIO_ENVIRONMENTS_LIST.value[
+                        env_var].get("completion_suffix"),
                 ))
         if save:
             save_env_file(path)
@@ -80,7 +89,7 @@ def check_requirements(requirements_list: List[str]) -> None:
             msg += f"\n  * {requirement}"
 
     if msg != INITIAL_MESSAGE:
-        logger.error(msg)
+        log(msg, "error")
         raise Exception(msg)
 
 
@@ -113,23 +122,50 @@ def directory_exists(directory: str) -> bool:
 
 def echo_and_run(
     command: str,
-    stdout_callback: Callable = partial(print, end=""),
+    stdout_callback: Callable = None,
     on_error: Union[Callable, str] = "raise",
 ) -> int:
     """
-    Echoes the command and then runs it, sending output to stdout_callback
+    Echoes the command and then runs it, sending output to stdout_callback, line by line. If no
+    callback is given, output is passed through to stdout in batches.
     """
     allowed_on_errors = ["raise", "return"]
     if on_error not in allowed_on_errors and not callable(on_error):
         log(f"Invalid on_error value: {on_error}", "error")
         raise ValueError(f"Invalid on_error: {on_error}")
     log(f'{random_emoji("technology")} {command}')
-    popen = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
-    for stdout_line in iter(popen.stdout.readline, ""):
-        stdout_callback(stdout_line)
-    popen.stdout.close()
-    return_code = popen.wait()
+    with span(command, "subprocess"):
+        mode = cassette.get_mode()
+        if mode == "replay":
+            interaction = cassette.replay("subprocess", command)
+            for stdout_line in interaction["output"]:
+                if stdout_callback:
+                    stdout_callback(stdout_line)
+                else:
+                    write_output(stdout_line.encode("utf-8"))
+            return_code = interaction["return_code"]
+        else:
+            start = perf_counter()
+            output = []
+            if stdout_callback:
+                popen = subprocess.Popen(
+                    command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+                for stdout_line in iter(popen.stdout.readline, ""):
+                    stdout_callback(stdout_line)
+                    if mode == "record":
+                        output.append(stdout_line)
+            else:
+                popen = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+                decoder = codecs.getincrementaldecoder("utf-8")("replace")
+                for chunk in iter(partial(read, popen.stdout.fileno(), 65536), b""):
+                    write_output(chunk)
+                    if mode == "record":
+                        output.append(decoder.decode(chunk))
+            popen.stdout.close()
+            return_code = popen.wait()
+            if mode == "record":
+                cassette.record("subprocess", command, perf_counter() - start,
+                                return_code=return_code, output=output)
     if return_code:
         if callable(on_error):
             on_error(return_code)
@@ -157,8 +193,13 @@ def get_confirmation(action: str) -> bool:
 
 def get_current_kubectl_context() -> str:
     """
-    Gets the current kubectl context
+    Gets the current kubectl context, from the cached kubeconfig when possible. Cassettes always
+    go through kubectl, so that they don't depend on the local kubeconfig.
     """
+    if cassette.get_mode() is None:
+        current_context = load_kube_contexts()["current_context"]
+        if current_context:
+            return current_context
     current_context = ""
 
     def callback(output: str):
@@ -172,10 +213,45 @@ def get_current_kubectl_context() -> str:
     return current_context
 
 
-def load_env_file(path: str = constants.DATARIO_ENVIRONMENTS_FILE.value) -> bool:
+def get_environments_file() -> str:
+    """
+    Gets the path to the environment file in use, which can be overriden through the
+    `DATARIO_ENVIRONMENTS_FILE` environment variable
+    """
+    return getenv("DATARIO_ENVIRONMENTS_FILE") or str(constants.DATARIO_ENVIRONMENTS_FILE.value)
+
+
+def http_get(url: str, headers: dict = None, session=None, secret: bool = False, **kwargs):
+    """
+    Sends a GET request to the given URL, through the given `requests.Session` if any. Responses
+    holding secrets are never recorded on cassettes, nor replayed from them
+    """
+    with span(f"GET {url}", "http"):
+        mode = None if secret else cassette.get_mode()
+        if mode == "replay":
+            interaction = cassette.replay("http", f"GET {url}")
+            if interaction.get("error"):
+                raise ConnectionError(interaction["error"])
+            return cassette.ReplayedResponse(interaction)
+        import requests
+        start = perf_counter()
+        try:
+            response = (session or requests).get(url, headers=headers, **kwargs)
+        except Exception as exc:
+            if mode == "record":
+                cassette.record("http", f"GET {url}", perf_counter() - start, error=str(exc))
+            raise
+        if mode == "record":
+            cassette.record("http", f"GET {url}", perf_counter() - start,
+                            status_code=response.status_code, text=response.text)
+        return response
+
+
+def load_env_file(path: str = None) -> bool:
     """
     Loads the given environment file
     """
+    path = path or get_environments_file()
     if not Path(path).exists():
         return False
     with open(path) as f:
@@ -185,14 +261,21 @@ def load_env_file(path: str = constants.DATARIO_ENVIRONMENTS_FILE.value) -> bool
     return True
 
 
-def prompt_env(message: str, default: str = None, callback_function: Callable = None) -> str:
+def prompt_env(
+    message: str,
+    default: str = None,
+    callback_function: Callable = None,
+    completion_suffix: str = None,
+) -> str:
     """
-    Prompts the user for the given environment variable
+    Prompts the user for the given environment variable. Paths ending with `completion_suffix`
+    are suggested first when completing.
     """
-    if default:
-        val = prompt(f"{message}", default=default)
-    else:
-        val = prompt(f"{message}")
+    with path_completer.preferring(completion_suffix):
+        if default:
+            val = prompt(f"{message}", default=default)
+        else:
+            val = prompt(f"{message}")
     if callback_function:
         val = callback_function(val)
     return val
@@ -203,15 +286,38 @@ def random_emoji(category: str = None) -> str:
     Returns a random emoji
     """
     if category:
-        return choice(constants.EMOJIS.value[category])
+        return choice(get_emojis(category))
     category = choice(list(constants.EMOJIS.value.keys()))
-    return choice(constants.EMOJIS.value[category])
+    return choice(get_emojis(category))
+
+
+def run_once(func: Callable) -> Callable:
+    """
+    Decorator that runs the given function only once per process for each set of arguments. Other
+    calls (even from other threads) wait for the first one and get its result back.
+    """
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = (func.__module__, func.__qualname__, repr(arguments.arguments))
+        with _RUN_ONCE_LOCK:
+            entry = _RUN_ONCE_CACHE.setdefault(key, {"lock": Lock(), "done": False})
+        with entry["lock"]:
+            if not entry["done"]:
+                entry["result"] = func(*args, **kwargs)
+                entry["done"] = True
+        return entry["result"]
+    return wrapper
 
 
-def save_env_file(path: str = constants.DATARIO_ENVIRONMENTS_FILE.value) -> bool:
+def save_env_file(path: str = None) -> bool:
     """
     Saves the current environment file to the given path
     """
+    path = path or get_environments_file()
     build_directory_tree(Path(path).parent)
     env_file = {}
     for key, value in environ.items():
@@ -229,6 +335,7 @@ def setenv(key: str, value: str) -> None:
     environ[key] = value
 
 
+@run_once
 def update_git_repo() -> None:
     """
     Updates the git repository
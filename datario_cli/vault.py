@@ -0,0 +1,160 @@
+"""
+Credentials read from Vault.
+
+Configurations may point to Vault instead of holding a value (or a path to a file), using
+references like `vault:secret/data/prefect#token`, i.e. the secret path and the field to read.
+Secrets are read from `DATARIO_VAULT_ADDRESS` (defaults to `DATARIO_VAULT_EXTERNAL_ADDRESS`) with
+`VAULT_TOKEN`, concurrently and over a single pooled connection. They're cached on disk, encrypted
+with a key derived from the token, until their lease (or `DATARIO_VAULT_CACHE_TTL`) expires. The
+disk cache requires the `cryptography` package.
+"""
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+from os import getenv
+from pathlib import Path
+from time import time
+from typing import Dict, Optional
+
+from datario_cli.constants import Constants as constants
+from datario_cli.logger import log
+from datario_cli.utils import build_directory_tree, http_get, random_emoji, run_once
+
+REFERENCE_PREFIX = "vault:"
+
+
+def is_reference(value: Optional[str]) -> bool:
+    """
+    Asserts that the given configuration value is a Vault reference.
+    """
+    return bool(value) and value.startswith(REFERENCE_PREFIX)
+
+
+def parse_reference(reference: str) -> tuple:
+    """
+    Splits a Vault reference into its secret path and field.
+    """
+    path, _, field = reference[len(REFERENCE_PREFIX):].partition("#")
+    if not path or not field:
+        raise ValueError(f"Invalid Vault reference (expected vault:<path>#<field>): {reference}")
+    return path.strip("/"), field
+
+
+def get_vault_address() -> str:
+    """
+    Gets the address of the Vault server.
+    """
+    return (getenv("DATARIO_VAULT_ADDRESS")
+            or constants.DATARIO_VAULT_EXTERNAL_ADDRESS.value).rstrip("/")
+
+
+@run_once
+def get_fernet(token: str):
+    """
+    Gets the cipher for the disk cache, keyed by the Vault token. Returns None, with a warning, if
+    the `cryptography` package isn't installed. Runs only once per process for each token.
+    """
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        log(f'{random_emoji("error")} O pacote `cryptography` não está instalado, então os segredos'
+            " do Vault não ficam em cache e são lidos a cada execução."
+            " Instale com `pip install datario_cli[vault]`.", "warning")
+        return None
+    key = hashlib.sha256(f"datario-vault-cache:{token}".encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def load_cache(fernet) -> Dict[str, Dict]:
+    """
+    Loads the unexpired entries of the disk cache.
+    """
+    path = Path(constants.DATARIO_VAULT_CACHE_FILE.value)
+    if fernet is None or not path.exists():
+        return {}
+    try:
+        cache = json.loads(fernet.decrypt(path.read_bytes()))
+    except Exception:
+        # Written with another token, or corrupted
+        return {}
+    now = time()
+    return {key: entry for key, entry in cache.items() if entry["expires_at"] > now}
+
+
+def save_cache(fernet, cache: Dict[str, Dict]) -> None:
+    """
+    Saves the disk cache, readable by the current user only.
+    """
+    if fernet is None:
+        return
+    path = Path(constants.DATARIO_VAULT_CACHE_FILE.value)
+    build_directory_tree(path.parent)
+    path.touch(mode=0o600, exist_ok=True)
+    path.write_bytes(fernet.encrypt(json.dumps(cache).encode("utf-8")))
+
+
+def read_secret(session, address: str, path: str, token: str) -> Dict:
+    """
+    Reads a secret from Vault, supporting both KV engine versions. Returns its data and lease
+    duration.
+    """
+    response = http_get(f"{address}/v1/{path}", headers={"X-Vault-Token": token},
+                        session=session, secret=True, timeout=30)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to read {path} from Vault: HTTP {response.status_code}")
+    body = json.loads(response.text)
+    data = body.get("data") or {}
+    if isinstance(data.get("data"), dict) and "metadata" in data:
+        data = data["data"]
+    return {"data": data, "lease_duration": body.get("lease_duration") or 0}
+
+
+def resolve_references(values: Dict[str, str]) -> Dict[str, str]:
+    """
+    Replaces the Vault references among the given values by the secrets they point to. Other
+    values are returned untouched.
+    """
+    references = {name: parse_reference(value)
+                  for name, value in values.items() if is_reference(value)}
+    if not references:
+        return dict(values)
+    token = getenv("VAULT_TOKEN")
+    if not token:
+        raise ValueError("VAULT_TOKEN must be set to read credentials from Vault")
+    address = get_vault_address()
+    fernet = get_fernet(token)
+    cache = load_cache(fernet)
+
+    def cache_key(path: str) -> str:
+        return hashlib.sha256(f"{address}/v1/{path}".encode("utf-8")).hexdigest()
+
+    missing = sorted({path for path, _ in references.values() if cache_key(path) not in cache})
+    if missing:
+        import requests
+        log(f'{random_emoji("technology")} Lendo {len(missing)} segredo(s) do Vault...')
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=len(missing))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                secrets = dict(zip(missing, executor.map(
+                    lambda path: read_secret(session, address, path, token), missing)))
+        default_ttl = int(getenv("DATARIO_VAULT_CACHE_TTL")
+                          or constants.DATARIO_VAULT_CACHE_TTL.value)
+        for path, secret in secrets.items():
+            cache[cache_key(path)] = {
+                "data": secret["data"],
+                "expires_at": time() + (secret["lease_duration"] or default_ttl),
+            }
+        save_cache(fernet, cache)
+
+    resolved = dict(values)
+    for name, (path, field) in references.items():
+        data = cache[cache_key(path)]["data"]
+        if field not in data:
+            raise ValueError(f"Field {field} not found on Vault secret {path}")
+        value = data[field]
+        resolved[name] = value if isinstance(value, str) else json.dumps(value)
+    return resolved